@@ -0,0 +1,254 @@
+from array import array
+from math import sqrt, log
+import random
+import sys
+import time
+
+import mcts
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ArrayTree(object):
+    """
+    An MCTS tree stored as a struct of arrays instead of MCTSNode objects.
+    Node i is described by entry i of each array:
+
+        visits, value   -- the search statistics
+        parent          -- index of the parent node, -1 for the root
+        move            -- index into moveTable of the move leading here
+        firstChild      -- index of the first child, -1 until expanded
+        numChildren     -- the children occupy a contiguous index range
+        numExpanded     -- how many of those children have been visited
+
+    Nodes do not store game states. Each iteration copies the root state
+    once and replays the moves on the way down. When a node is expanded all
+    of its children are allocated at once, in random order, and handed out
+    one at a time like the frontier of an MCTSNode.
+    """
+
+    C = sqrt(2)
+
+    def __init__(self, gamestate):
+        self.gamestate = gamestate
+
+        self.visits = array('l')
+        self.value = array('l')
+        self.parent = array('l')
+        self.move = array('l')
+        self.firstChild = array('l')
+        self.numChildren = array('l')
+        self.numExpanded = array('l')
+
+        # Moves may be any hashable value, so they are interned here and the
+        # tree only stores their index
+        self.moveTable = []
+        self.moveIndex = {}
+
+        self._addNode(-1, -1)
+
+    def __len__(self):
+        return len(self.visits)
+
+    def _addNode(self, parent, move):
+        self.visits.append(0)
+        self.value.append(0)
+        self.parent.append(parent)
+        self.move.append(move)
+        self.firstChild.append(-1)
+        self.numChildren.append(0)
+        self.numExpanded.append(0)
+
+    def _internMove(self, move):
+        index = self.moveIndex.get(move)
+        if index is None:
+            index = len(self.moveTable)
+            self.moveTable.append(move)
+            self.moveIndex[move] = index
+        return index
+
+    def _allocateChildren(self, node, legalMoves):
+        random.shuffle(legalMoves)
+        self.firstChild[node] = len(self.visits)
+        self.numChildren[node] = len(legalMoves)
+        for move in legalMoves:
+            self._addNode(node, self._internMove(move))
+
+    def _selectBestChild(self, node):
+        first = self.firstChild[node]
+        last = first + self.numChildren[node]
+        logN = log(self.visits[node])
+
+        if numpy is not None:
+            # Views over the array buffers, so no data is copied
+            w = numpy.frombuffer(self.value, dtype='l')[first:last]
+            n = numpy.frombuffer(self.visits, dtype='l')[first:last]
+            uct = w / n.astype(float) + self.C * numpy.sqrt(logN / n)
+            return first + int(numpy.argmax(uct))
+
+        visits, value, C = self.visits, self.value, self.C
+        return max(xrange(first, last),
+                   key=lambda i: float(value[i]) / visits[i] +
+                   C * sqrt(logN / visits[i]))
+
+    def iterate(self):
+        """
+        Runs one select, expand, simulate and backpropagate iteration.
+        """
+
+        gamestate = self.gamestate.copy()
+        node = 0
+
+        while gamestate.winner is None:
+            if self.firstChild[node] == -1:
+                self._allocateChildren(node, gamestate.getLegalMoves())
+
+            expanded = self.numExpanded[node]
+            if expanded < self.numChildren[node]:
+                self.numExpanded[node] = expanded + 1
+                node = self.firstChild[node] + expanded
+                gamestate.executeMove(self.moveTable[self.move[node]])
+                break
+
+            node = self._selectBestChild(node)
+            gamestate.executeMove(self.moveTable[self.move[node]])
+
+        reward = mcts.rollout(gamestate)
+
+        while node != -1:
+            self.visits[node] += 1
+            self.value[node] += reward
+            reward = -reward
+            node = self.parent[node]
+
+    def search(self, iterations=None, timeLimit=None):
+        assert iterations is not None or timeLimit is not None
+
+        deadline = None if timeLimit is None else time.time() + timeLimit
+
+        i = 0
+        while iterations is None or i < iterations:
+            if deadline is not None and time.time() >= deadline:
+                break
+            self.iterate()
+            i += 1
+
+        return i
+
+    def rootStatistics(self):
+        first = self.firstChild[0]
+        return dict((self.moveTable[self.move[i]],
+                     (self.visits[i], self.value[i]))
+                    for i in xrange(first, first + self.numExpanded[0]))
+
+    def selectBestMove(self):
+        return mcts.selectBestMoveFromStatistics(self.rootStatistics(),
+                                                 self.gamestate)
+
+    def nbytes(self):
+        arrays = [self.visits, self.value, self.parent, self.move,
+                  self.firstChild, self.numChildren, self.numExpanded]
+        return sum(sys.getsizeof(a) for a in arrays) + \
+            _deepSizeOf(self.moveTable, set()) + \
+            _deepSizeOf(self.moveIndex, set())
+
+
+def arrayMCTS(gamestate, iterations=None, timeLimit=None):
+    tree = ArrayTree(gamestate)
+    tree.search(iterations, timeLimit)
+    return tree.selectBestMove()
+
+
+def _deepSizeOf(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += _deepSizeOf(key, seen) + _deepSizeOf(value, seen)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += _deepSizeOf(item, seen)
+    elif hasattr(obj, '__dict__'):
+        size += _deepSizeOf(obj.__dict__, seen)
+
+    return size
+
+
+def _objectTreeSize(root):
+    # Parents are marked as seen first so sizing a node never walks back up
+    # the tree. In a DAG a shared node is only counted once, and a
+    # transposition table only for its own dictionary.
+    seen = set()
+    size = 0
+    numNodes = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        seen.add(id(node.__dict__))
+        size += sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+        for key, value in node.__dict__.iteritems():
+            if key == 'table':
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value.nodes)
+            elif key not in ('parent', 'children'):
+                size += _deepSizeOf(value, seen)
+        size += sys.getsizeof(node.children)
+        numNodes += 1
+        stack.extend(node.children.itervalues())
+
+    return size, numNodes
+
+
+def compareWithObjectTree(gamestate, iterations):
+    """
+    Runs the same number of iterations with MCTSNode and with ArrayTree and
+    prints bytes per node and iterations per second for both.
+    """
+
+    root = mcts.MCTSNode(gamestate.copy())
+    start = time.time()
+    mcts.search(root, iterations)
+    objectTime = time.time() - start
+    objectBytes, objectNodes = _objectTreeSize(root)
+
+    tree = ArrayTree(gamestate.copy())
+    start = time.time()
+    tree.search(iterations)
+    arrayTime = time.time() - start
+
+    print "%-12s %10s %14s %14s" % ('backend', 'nodes', 'bytes/node',
+                                     'iterations/s')
+    print "%-12s %10d %14.1f %14.1f" % ('MCTSNode', objectNodes,
+                                         float(objectBytes) / objectNodes,
+                                         iterations / objectTime)
+    print "%-12s %10d %14.1f %14.1f" % ('ArrayTree', len(tree),
+                                         float(tree.nbytes()) / len(tree),
+                                         iterations / arrayTime)
+
+
+def main():
+    import connectfour
+    import quoridor
+    import tictactoe
+
+    print "Tic-tac-toe, 10000 iterations"
+    compareWithObjectTree(tictactoe.TicTacToeGameState(), 10000)
+    print
+    print "Connect Four, 20000 iterations"
+    compareWithObjectTree(connectfour.ConnectFourGameState(), 20000)
+    print
+    print "Quoridor, 200 iterations"
+    compareWithObjectTree(quoridor.QuoridorGameState(), 200)
+
+if __name__ == '__main__':
+    main()
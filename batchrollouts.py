@@ -0,0 +1,192 @@
+"""
+Random rollouts for Connect Four and tic-tac-toe, played many games at a
+time with NumPy. All games advance in lockstep: one random legal move is
+drawn for every unfinished game at once and wins are detected by testing
+every winning line of every board in a single array operation.
+"""
+
+import random
+import time
+
+import numpy
+
+import connectfour
+import mcts
+import tictactoe
+
+
+def _lineIndices(width, height, length):
+    # Every horizontal, vertical and diagonal run of the given length, as
+    # indices into a board flattened row by row
+    lines = []
+    for r in xrange(height):
+        for c in xrange(width):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                endRow = r + dr * (length - 1)
+                endCol = c + dc * (length - 1)
+                if 0 <= endRow < height and 0 <= endCol < width:
+                    lines.append([(r + dr * k) * width + c + dc * k
+                                  for k in xrange(length)])
+
+    return numpy.array(lines, dtype=numpy.intp)
+
+
+class _ConnectFourBatch(object):
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.lines = _lineIndices(width, height, 4)
+
+    def encode(self, gamestate):
+        return [c for row in gamestate.board for c in row]
+
+    def legalMask(self, boards):
+        # A column is playable while its top cell (row 0) is empty
+        return boards[:, :self.width] == 0
+
+    def play(self, boards, games, moves, players):
+        columns = boards.reshape(len(boards), self.height, self.width)
+        emptyCells = (columns[games, :, moves] == 0).sum(axis=1)
+        boards[games, (emptyCells - 1) * self.width + moves] = players
+
+
+class _TicTacToeBatch(object):
+
+    def __init__(self):
+        self.lines = _lineIndices(3, 3, 3)
+
+    def encode(self, gamestate):
+        return gamestate.board
+
+    def legalMask(self, boards):
+        return boards == 0
+
+    def play(self, boards, games, moves, players):
+        boards[games, moves] = players
+
+
+def _batchFor(gamestate):
+    if isinstance(gamestate, tictactoe.TicTacToeGameState):
+        return _TicTacToeBatch()
+    if isinstance(gamestate, (connectfour.ConnectFourGameState,
+                              connectfour.BitboardConnectFourGameState)):
+        return _ConnectFourBatch(gamestate.width, gamestate.height)
+    raise TypeError("No batch rollouts for " + type(gamestate).__name__)
+
+
+def batchRollout(gamestates, rng=numpy.random):
+    """
+    Plays one random game from each of the given gamestates, which must all
+    be of the same game and board size, and returns the rewards as an array.
+    Each reward is from the perspective of the player who made the last
+    move in its starting state, as in mcts.rollout. The gamestates are not
+    modified.
+    """
+
+    batch = _batchFor(gamestates[0])
+
+    boards = numpy.array([batch.encode(g) for g in gamestates],
+                         dtype=numpy.int8)
+    players = numpy.array([g.currentPlayer for g in gamestates],
+                          dtype=numpy.int8)
+    lastMover = 3 - players
+    winners = numpy.array([-1 if g.winner is None else g.winner
+                           for g in gamestates], dtype=numpy.int8)
+
+    active = numpy.flatnonzero(winners == -1)
+
+    while active.size:
+        # A uniformly random legal move per game: the legal move with the
+        # largest random key
+        legal = batch.legalMask(boards[active])
+        keys = rng.random_sample(legal.shape)
+        keys[~legal] = -1.0
+        moves = keys.argmax(axis=1)
+
+        movers = players[active]
+        batch.play(boards, active, moves, movers)
+
+        activeBoards = boards[active]
+        won = (activeBoards[:, batch.lines] ==
+               movers[:, None, None]).all(axis=2).any(axis=1)
+        full = ~(activeBoards == 0).any(axis=1)
+
+        winners[active[won]] = movers[won]
+        winners[active[full & ~won]] = 0
+        players[active] = 3 - movers
+
+        active = active[winners[active] == -1]
+
+    rewards = numpy.where(winners == lastMover, 1, -1)
+    rewards[winners == 0] = 0
+
+    return rewards
+
+
+def batchMCTS(root, iterations=None, timeLimit=None, rolloutsPerLeaf=128):
+    """
+    Like mcts.mcts, but every selected leaf is scored with rolloutsPerLeaf
+    batched rollouts and backed up as that many visits. Results are backed
+    up along parent links, so DAG (transposition) trees are not supported.
+    """
+
+    assert iterations is not None or timeLimit is not None
+    assert not isinstance(root, mcts.TranspositionMCTSNode)
+
+    stateless = isinstance(root, mcts.StatelessMCTSNode)
+    deadline = None if timeLimit is None else time.time() + timeLimit
+
+    i = 0
+    while iterations is None or i < iterations:
+        if deadline is not None and time.time() >= deadline:
+            break
+
+        if stateless:
+            gamestate = root.gamestate.copy()
+            node = mcts.selectStateless(root, gamestate)
+        else:
+            node = mcts.select(root)
+            gamestate = node.gamestate
+
+        reward = int(batchRollout([gamestate] * rolloutsPerLeaf).sum())
+        mcts.backpropagate(node, reward, rolloutsPerLeaf)
+
+        i += 1
+
+    return root.selectBestMove()
+
+
+def compareWithRollout(gamestate, numRollouts):
+    """
+    Prints rollouts per second and mean reward for mcts.rollout and for
+    batchRollout from the same position.
+    """
+
+    start = time.time()
+    rewards = [mcts.rollout(gamestate.copy()) for _ in xrange(numRollouts)]
+    scalarTime = time.time() - start
+
+    start = time.time()
+    batchRewards = batchRollout([gamestate] * numRollouts)
+    batchTime = time.time() - start
+
+    print "%-14s %14s %12s" % ('engine', 'rollouts/s', 'mean reward')
+    print "%-14s %14.1f %12.3f" % ('mcts.rollout', numRollouts / scalarTime,
+                                   float(sum(rewards)) / numRollouts)
+    print "%-14s %14.1f %12.3f" % ('batchRollout', numRollouts / batchTime,
+                                   batchRewards.mean())
+
+
+def main():
+    random.seed(0)
+    numpy.random.seed(0)
+
+    print "Tic-tac-toe, 20000 rollouts"
+    compareWithRollout(tictactoe.TicTacToeGameState(), 20000)
+    print
+    print "Connect Four, 20000 rollouts"
+    compareWithRollout(connectfour.BitboardConnectFourGameState(), 20000)
+
+if __name__ == '__main__':
+    main()
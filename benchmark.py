@@ -0,0 +1,364 @@
+"""
+Seeded MCTS benchmarks over a fixed corpus of opening, mid-game and
+late-game positions for each game. For every position it reports search
+iterations per second, how the search time splits across the select,
+simulate and backpropagate phases, and random games per second and mean
+rollout length from that position.
+
+    python benchmark.py [--output results.json] [--compare baseline.json]
+                        [--tolerance 0.1] [--games tictactoe,quoridor]
+                        [--scale 0.1] [--repeat 3] [--scaling]
+
+Results are written as JSON. With --compare, every throughput figure is
+checked against a saved result file and the run exits with status 1 if any
+of them dropped by more than the tolerance.
+
+With --scaling, the mid-game position of each game is instead searched with
+mcts.treeParallelMCTS for 1, 2, 4, ... workers up to the number of cores,
+and the wall-clock iterations per second are compared with a sequential
+search.
+"""
+
+from collections import OrderedDict
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import sys
+import time
+
+import connectfour
+import mcts
+import quoridor
+import tictactoe
+
+
+# Per game: how to build the start position and parse the corpus moves, the
+# tree node class to search with, the number of search iterations and of
+# standalone rollouts per position, and the positions as move lists from
+# the start position.
+GAMES = OrderedDict([
+    ('tictactoe', {
+        'newGame': tictactoe.TicTacToeGameState,
+        'parseMove': int,
+        'nodeClass': mcts.MCTSNode,
+        'iterations': 5000,
+        'rollouts': 5000,
+        'positions': OrderedDict([
+            ('opening', []),
+            ('midgame', [4, 7]),
+            ('lategame', [8, 2, 6, 5, 4]),
+        ]),
+    }),
+    ('connectfour', {
+        'newGame': connectfour.BitboardConnectFourGameState,
+        'parseMove': int,
+        'nodeClass': mcts.MCTSNode,
+        'iterations': 5000,
+        'rollouts': 5000,
+        'positions': OrderedDict([
+            ('opening', []),
+            ('midgame', [0, 0, 2, 5, 1, 3, 2, 5, 6, 2, 6, 0, 5, 6]),
+            ('lategame', [2, 3, 1, 4, 5, 2, 0, 6, 6, 0, 3, 4, 2, 5, 6, 4, 2,
+                          1, 1, 1, 0, 1, 5, 3, 5, 6, 5, 0, 6, 0]),
+        ]),
+    }),
+    ('quoridor', {
+        'newGame': quoridor.QuoridorGameState,
+        'parseMove': quoridor.parseMove,
+        'nodeClass': mcts.StatelessMCTSNode,
+        'iterations': 200,
+        'rollouts': 200,
+        'positions': OrderedDict([
+            ('opening', []),
+            ('midgame', ['v73', 'h77', 'v61', 'v41', 'v15', 'h16', 'v62',
+                         'h28', 'v53', 'v33']),
+            ('lategame', ['v55', 'v52', 'h44', 'h88', 'h72', 'h25', 'v34',
+                          'h22', 'h38', 'v12', 'h74', 'v58', 'h46', 'v84',
+                          'h33', 'h61', 'h85', 'v56', 'h57', 'h35', '77',
+                          '13', '76', '12', '77', '3', '78', '2', '79', '11',
+                          '78', '2', '79', '11', '78', '2', '69', '3', '68',
+                          '12']),
+        ]),
+    }),
+])
+
+PHASES = ['select', 'simulate', 'backpropagate']
+
+# The figures compared against a baseline; higher is better for all of them
+THROUGHPUT_METRICS = ['iterationsPerSecond', 'gamesPerSecond']
+
+
+def buildPosition(game, moves):
+    gamestate = game['newGame']()
+    for move in moves:
+        gamestate.executeMove(game['parseMove'](move))
+    return gamestate
+
+
+def benchmarkSearch(gamestate, nodeClass, iterations):
+    # Throughput is measured in wall-clock time, like benchmarkScaling;
+    # the phase times are the processor times kept by SearchStats. A very
+    # short search can take no measurable time at all.
+    stats = mcts.SearchStats(timeMoveSelection=False)
+    root = nodeClass(gamestate.copy())
+
+    start = time.time()
+    mcts.search(root, iterations, stats=stats)
+    elapsed = max(time.time() - start, 1e-9)
+
+    phaseTimes = stats.phaseTimes
+
+    total = sum(phaseTimes.itervalues())
+    return {
+        'iterations': iterations,
+        'seconds': elapsed,
+        'iterationsPerSecond': iterations / elapsed,
+        'phaseSeconds': phaseTimes,
+        'phaseShare': dict((phase, phaseTimes[phase] / total if total else 0.0)
+                           for phase in PHASES),
+    }
+
+
+def benchmarkRollouts(gamestate, rollouts):
+    stats = mcts.SearchStats(timeMoveSelection=False)
+    start = time.time()
+    for _ in xrange(rollouts):
+        mcts.rollout(gamestate.copy(), stats)
+    elapsed = max(time.time() - start, 1e-9)
+
+    return {
+        'rollouts': rollouts,
+        'gamesPerSecond': rollouts / elapsed,
+        'meanRolloutLength': float(stats.rolloutMoves) / rollouts,
+    }
+
+
+def _fastest(measure, repeat, seed, metric):
+    # The random module is reseeded before every run so each one does the
+    # same work; the fastest run is the one least disturbed by the system
+    results = []
+    for _ in xrange(repeat):
+        random.seed(seed)
+        results.append(measure())
+    return max(results, key=lambda result: result[metric])
+
+
+def runBenchmarks(games=None, seed=0, scale=1.0, repeat=3):
+    """
+    Runs every position of the given games, or of all games, and returns
+    the results keyed by 'game/phase'. Each measurement is seeded, so the
+    searched trees are the same from run to run, and repeated, keeping the
+    fastest run. scale multiplies the iteration and rollout counts.
+    """
+
+    results = OrderedDict()
+    for name, game in GAMES.iteritems():
+        if games is not None and name not in games:
+            continue
+
+        iterations = max(1, int(game['iterations'] * scale))
+        rollouts = max(1, int(game['rollouts'] * scale))
+
+        for phase, moves in game['positions'].iteritems():
+            gamestate = buildPosition(game, moves)
+
+            result = _fastest(
+                lambda: benchmarkSearch(gamestate, game['nodeClass'],
+                                        iterations),
+                repeat, seed, 'iterationsPerSecond')
+            result.update(_fastest(
+                lambda: benchmarkRollouts(gamestate, rollouts),
+                repeat, seed, 'gamesPerSecond'))
+
+            results[name + '/' + phase] = result
+            printResult(name + '/' + phase, result)
+
+    return results
+
+
+def benchmarkScaling(gamestate, nodeClass, iterations, seed):
+    """
+    Returns the wall-clock iterations per second of a sequential search and
+    of tree-parallel searches with 1, 2, 4, ... workers up to the number of
+    cores, each with the speedup over the sequential search.
+    """
+
+    random.seed(seed)
+    root = nodeClass(gamestate.copy())
+    start = time.time()
+    mcts.search(root, iterations)
+    sequential = iterations / (time.time() - start)
+
+    results = OrderedDict()
+    results['sequential'] = {'iterationsPerSecond': sequential,
+                             'speedup': 1.0}
+
+    numCores = multiprocessing.cpu_count()
+    workerCounts = [1]
+    while workerCounts[-1] * 2 <= max(numCores, 2):
+        workerCounts.append(workerCounts[-1] * 2)
+
+    for numWorkers in workerCounts:
+        # The pool is started beforehand so only the search is timed. Each
+        # process reseeds itself, as forked workers share the random state.
+        pool = multiprocessing.Pool(numWorkers, random.seed)
+        try:
+            random.seed(seed)
+            root = nodeClass(gamestate.copy())
+            start = time.time()
+            mcts.treeParallelMCTS(root, iterations, numWorkers=numWorkers,
+                                  pool=pool)
+            rate = iterations / (time.time() - start)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        results['%d workers' % numWorkers] = {
+            'iterationsPerSecond': rate, 'speedup': rate / sequential}
+
+    return results
+
+
+def runScaling(games=None, seed=0, scale=1.0):
+    """
+    Runs benchmarkScaling on the mid-game position of the given games, or
+    of all games, and returns the results keyed by 'game/midgame'.
+    """
+
+    print "%d cores" % multiprocessing.cpu_count()
+    print "%-22s %-12s %12s %8s" % ('position', 'search', 'iterations/s',
+                                    'speedup')
+
+    results = OrderedDict()
+    for name, game in GAMES.iteritems():
+        if games is not None and name not in games:
+            continue
+
+        key = name + '/midgame'
+        gamestate = buildPosition(game, game['positions']['midgame'])
+        iterations = max(1, int(game['iterations'] * scale))
+        results[key] = benchmarkScaling(gamestate, game['nodeClass'],
+                                        iterations, seed)
+        for search, result in results[key].iteritems():
+            print "%-22s %-12s %12.1f %7.2fx" % (
+                key, search, result['iterationsPerSecond'],
+                result['speedup'])
+
+    return results
+
+
+def printHeader():
+    print "%-22s %12s %10s %10s %10s %10s %10s" % (
+        'position', 'iterations/s', 'select', 'simulate', 'backprop',
+        'games/s', 'length')
+
+
+def printResult(key, result):
+    share = result['phaseShare']
+    print "%-22s %12.1f %9.1f%% %9.1f%% %9.1f%% %10.1f %10.1f" % (
+        key, result['iterationsPerSecond'], 100 * share['select'],
+        100 * share['simulate'], 100 * share['backpropagate'],
+        result['gamesPerSecond'], result['meanRolloutLength'])
+
+
+def compareResults(results, baseline, tolerance):
+    """
+    Prints the change of each throughput figure against the baseline and
+    returns the list of (position, metric) pairs that dropped by more than
+    the tolerance, a fraction.
+    """
+
+    regressions = []
+
+    print "%-22s %-20s %12s %12s %8s" % ('position', 'metric', 'baseline',
+                                          'current', 'change')
+    for key, result in results.iteritems():
+        if key not in baseline:
+            continue
+
+        for metric in THROUGHPUT_METRICS:
+            old = baseline[key][metric]
+            new = result[metric]
+            change = (new - old) / old
+            flag = ''
+            if change < -tolerance:
+                regressions.append((key, metric))
+                flag = '  REGRESSION'
+            print "%-22s %-20s %12.1f %12.1f %7.1f%%%s" % (
+                key, metric, old, new, 100 * change, flag)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark MCTS searches.')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='file to write the results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='result file to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='largest allowed drop in throughput, as a '
+                             'fraction (default 0.1)')
+    parser.add_argument('--games', help='comma separated games to run '
+                                        '(default all): ' +
+                                        ','.join(GAMES.iterkeys()))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplies the iteration and rollout counts')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per measurement, the fastest is kept')
+    parser.add_argument('--scaling', action='store_true',
+                        help='measure tree-parallel scaling instead')
+    args = parser.parse_args(argv)
+
+    games = args.games.split(',') if args.games else None
+
+    if args.scaling:
+        results = runScaling(games, args.seed, args.scale)
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cores': multiprocessing.cpu_count(),
+                'seed': args.seed,
+                'scale': args.scale,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'scaling': results,
+            }, f, indent=2, sort_keys=True)
+        print
+        print "Results written to", args.output
+        return 0
+
+    printHeader()
+    results = runBenchmarks(games, args.seed, args.scale, args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'scale': args.scale,
+            'repeat': args.repeat,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+    print
+    print "Results written to", args.output
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print
+        regressions = compareResults(results, baseline, args.tolerance)
+        if regressions:
+            print
+            print "%d regressions beyond %.0f%%" % (len(regressions),
+                                                    100 * args.tolerance)
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
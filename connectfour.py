@@ -2,7 +2,31 @@ __author__ = 'Mark'
 
 import random
 
+_zobristTables = {}
+
+def zobristTable(numCells):
+    """
+    Returns the Zobrist keys for a board of numCells cells, one list of
+    keys per player. Tables are built once per size from a fixed seed, so a
+    position hashes the same in every process.
+    """
+
+    if numCells not in _zobristTables:
+        rng = random.Random(numCells)
+        _zobristTables[numCells] = [
+            [rng.getrandbits(64) for _ in xrange(numCells)]
+            for _ in xrange(2)]
+
+    return _zobristTables[numCells]
+
 class ConnectFourGameState(object):
+    """
+    Connect Four on a list of rows, top row first.
+
+    The position is tracked by an incremental Zobrist hash, plus the hash
+    of its left-right mirror image so that symmetric positions can be
+    recognised.
+    """
 
     def __init__(self, width=7, height=6):
         self.currentPlayer = 1
@@ -10,12 +34,23 @@ class ConnectFourGameState(object):
         self.width = width
         self.height = height
         self.winner = None
+        self.zobrist = zobristTable(width * height)
+        self.hash = 0
+        self.mirrorHash = 0
+
+        # Cells played on this state, most recent last, for undoMove. Only
+        # recorded while trackUndo is set, as rollouts never take moves
+        # back. A copy starts with an empty stack and without tracking.
+        self.trackUndo = False
+        self.moveStack = []
 
     def copy(self):
-        gamestate = ConnectFourGameState()
+        gamestate = ConnectFourGameState(self.width, self.height)
         gamestate.board = [list(row) for row in self.board]
         gamestate.currentPlayer = self.currentPlayer
         gamestate.winner = self.winner
+        gamestate.hash = self.hash
+        gamestate.mirrorHash = self.mirrorHash
 
         return gamestate
 
@@ -31,8 +66,23 @@ class ConnectFourGameState(object):
                 break
 
         self.board[r][move] = self.currentPlayer
+        keys = self.zobrist[self.currentPlayer - 1]
+        self.hash ^= keys[r * self.width + move]
+        self.mirrorHash ^= keys[r * self.width + self.width - 1 - move]
         self.checkForWin(r, move, self.currentPlayer)
         self.currentPlayer = 3 - self.currentPlayer
+        if self.trackUndo:
+            self.moveStack.append((r, move))
+
+    def undoMove(self):
+        r, move = self.moveStack.pop()
+
+        self.currentPlayer = 3 - self.currentPlayer
+        self.board[r][move] = 0
+        keys = self.zobrist[self.currentPlayer - 1]
+        self.hash ^= keys[r * self.width + move]
+        self.mirrorHash ^= keys[r * self.width + self.width - 1 - move]
+        self.winner = None
 
 
     def getLegalMoves(self):
@@ -42,67 +92,35 @@ class ConnectFourGameState(object):
 
         return legalMoves
 
+    def mirrorMove(self, move):
+        # The same move in the mirror image of the position, see mirrorHash
+        return self.width - 1 - move
+
 
     def checkForWin(self, _r, _c, player):
 
-        rmin = self._clamp(_r - 3, 0, self.height)
-        rmax = self._clamp(_r + 3, 0, self.height - 1)
-        cmin = self._clamp(_c - 3, 0, self.width)
-        cmax = self._clamp(_c + 3, 0, self.width - 1)
-        # Check only cells adjacent to the last played move
-
-        row = self.board[_r]
-        col = [_row[_c] for _row in self.board]
-
-        count = 0
-        for c in xrange(cmin, cmax + 1):
-            if row[c] == player:
-                count += 1
-            else:
-                count = 0
-
-            if count == 4:
-                self.winner = player
-
-        count = 0
-        for r in xrange(rmin, rmax + 1):
-            if col[r] == player:
-                count += 1
-            else:
-                count = 0
-
-            if count == 4:
-                self.winner = player
-
-        count = 0
-        for r, c in zip(xrange(rmax, rmin - 1, -1), xrange(cmin, cmax + 1)):
-            if self.board[r][c] == player:
-                count += 1
-            else:
-                count = 0
-
-            if count == 4:
-                self.winner = player
-
-        count = 0
-        for r, c in zip(xrange(rmin, rmax + 1), xrange(cmin, cmax + 1)):
-            if self.board[r][c] == player:
-                count += 1
-            else:
-                count = 0
-
-            if count == 4:
-                self.winner = player
+        # Check only the lines through the played cell: its row, its column
+        # and its two diagonals, up to three cells either side
+        for dr, dc in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+            count = 0
+            for i in xrange(-3, 4):
+                r = _r + i * dr
+                c = _c + i * dc
+                if 0 <= r < self.height and 0 <= c < self.width and \
+                        self.board[r][c] == player:
+                    count += 1
+                else:
+                    count = 0
+
+                if count == 4:
+                    self.winner = player
+                    return
 
         # If the top row has no empty slots, its a draw
         if 0 not in self.board[0]:
             self.winner = 0
 
 
-    def _clamp(self, value, minimum, maximum):
-        return max(minimum, min(value, maximum))
-
-
     def __repr__(self):
         out = []
         icons = ['-', 'x', 'o']
@@ -115,6 +133,152 @@ class ConnectFourGameState(object):
         return ''.join(out)
 
 
+class BitboardConnectFourGameState(object):
+    """
+    Connect Four on bitboards. Each player's stones are one integer mask.
+    Column c occupies bits c * (height + 1) up to c * (height + 1) + height,
+    bottom to top; the extra bit on top of each column stays empty so that
+    shifted lines never wrap from one column into the next.
+
+    Same interface as ConnectFourGameState, including the Zobrist hashes,
+    with a board property that rebuilds the list of rows for display.
+    """
+
+    def __init__(self, width=7, height=6):
+        self.currentPlayer = 1
+        self.width = width
+        self.height = height
+        self.winner = None
+
+        self.stones = [0, 0]
+        self.numMoves = 0
+
+        # The bit index of the next free cell in each column
+        self.heights = [c * (height + 1) for c in xrange(width)]
+
+        # The shifts that move a stone one step along a column, a row and
+        # the two diagonals
+        self.directions = (1, height + 1, height, height + 2)
+
+        # Keys are indexed by bit position, sentinel bits included
+        self.zobrist = zobristTable(width * (height + 1))
+        self.hash = 0
+        self.mirrorHash = 0
+
+        # Columns played on this state, most recent last, for undoMove. Only
+        # recorded while trackUndo is set, as rollouts never take moves
+        # back. A copy starts with an empty stack and without tracking.
+        self.trackUndo = False
+        self.moveStack = []
+
+    def copy(self):
+        gamestate = BitboardConnectFourGameState(self.width, self.height)
+        gamestate.stones = list(self.stones)
+        gamestate.heights = list(self.heights)
+        gamestate.numMoves = self.numMoves
+        gamestate.currentPlayer = self.currentPlayer
+        gamestate.winner = self.winner
+        gamestate.hash = self.hash
+        gamestate.mirrorHash = self.mirrorHash
+
+        return gamestate
+
+    def executeMove(self, move):
+        assert self.winner is None
+
+        bit = self.heights[move]
+        stones = self.stones[self.currentPlayer - 1] | 1 << bit
+        self.stones[self.currentPlayer - 1] = stones
+        self.heights[move] += 1
+
+        keys = self.zobrist[self.currentPlayer - 1]
+        self.hash ^= keys[bit]
+        self.mirrorHash ^= keys[bit + (self.width - 1 - 2 * move) *
+                                (self.height + 1)]
+        self.numMoves += 1
+
+        for shift in self.directions:
+            pairs = stones & (stones >> shift)
+            if pairs & (pairs >> 2 * shift):
+                self.winner = self.currentPlayer
+                break
+        else:
+            if self.numMoves == self.width * self.height:
+                self.winner = 0
+
+        self.currentPlayer = 3 - self.currentPlayer
+        if self.trackUndo:
+            self.moveStack.append(move)
+
+    def undoMove(self):
+        move = self.moveStack.pop()
+
+        self.currentPlayer = 3 - self.currentPlayer
+        self.heights[move] -= 1
+        bit = self.heights[move]
+        self.stones[self.currentPlayer - 1] ^= 1 << bit
+        self.numMoves -= 1
+
+        keys = self.zobrist[self.currentPlayer - 1]
+        self.hash ^= keys[bit]
+        self.mirrorHash ^= keys[bit + (self.width - 1 - 2 * move) *
+                                (self.height + 1)]
+        self.winner = None
+
+    def getLegalMoves(self):
+        step = self.height + 1
+        return [c for c, h in enumerate(self.heights)
+                if h < c * step + self.height]
+
+    def getWinningMoves(self, player):
+        """
+        Returns the columns where a stone of player (1 or 2) would complete
+        four in a row, whether or not it is that player's turn.
+        """
+
+        step = self.height + 1
+        stones = self.stones[player - 1]
+        winningMoves = []
+        for c, bit in enumerate(self.heights):
+            if bit == c * step + self.height:
+                continue
+            line = stones | 1 << bit
+            for shift in self.directions:
+                pairs = line & (line >> shift)
+                if pairs & (pairs >> 2 * shift):
+                    winningMoves.append(c)
+                    break
+
+        return winningMoves
+
+    def mirrorMove(self, move):
+        return self.width - 1 - move
+
+    @property
+    def board(self):
+        step = self.height + 1
+        board = [[0] * self.width for _ in xrange(self.height)]
+        for c in xrange(self.width):
+            for r in xrange(self.height):
+                bit = 1 << (c * step + r)
+                if self.stones[0] & bit:
+                    board[self.height - 1 - r][c] = 1
+                elif self.stones[1] & bit:
+                    board[self.height - 1 - r][c] = 2
+
+        return board
+
+    def __repr__(self):
+        out = []
+        icons = ['-', 'x', 'o']
+
+        for row in self.board:
+            out.append(''.join(icons[c] for c in row))
+            out.append("\n")
+
+        return ''.join(out)
+
+
 def playRandomMoves(num_moves = 10):
     moves = [random.randint(0, 6) for _ in xrange(num_moves)]
 
@@ -54,6 +54,66 @@ def bridge(graph, root, numVertices):
     return bridges
 
 
+def shortestPath(gamestate, player):
+    """
+    Breadth first search from the player's pawn to the player's goal node.
+    Returns the cells along a shortest path, starting with the pawn's cell
+    and ending with the last cell before the goal node, or None if the goal
+    cannot be reached.
+    """
+
+    graph = gamestate.cellGraph
+    root = gamestate.playerPositions[player]
+    goal = [gamestate.PLAYER1_GOAL, gamestate.PLAYER2_GOAL][player]
+
+    parent = [None] * len(graph)
+    parent[root] = root
+    frontier = deque([root])
+
+    while frontier:
+        current = frontier.popleft()
+        for n in graph[current]:
+            if n == goal:
+                path = [current]
+                while current != root:
+                    current = parent[current]
+                    path.append(current)
+                path.reverse()
+                return path
+            if parent[n] is None:
+                parent[n] = current
+                frontier.append(n)
+
+    return None
+
+
+def floodFillReachable(gamestate, player):
+    """
+    Returns whether the player can reach their goal row, like
+    greedyBestFirst, but works on the board's edge bitmasks (openEast and
+    openSouth) instead of the cell graph. The set of reachable cells is a
+    bitmask that grows by one step in every direction per round, using
+    shifts masked by the open edges, until it touches the goal row or stops
+    growing.
+    """
+
+    east = gamestate.openEast
+    south = gamestate.openSouth
+    width = gamestate.boardSize
+    goalRow = gamestate.goalRows[player]
+
+    reached = 1 << gamestate.playerPositions[player]
+
+    while not reached & goalRow:
+        grown = reached | (reached & east) << 1 | (reached >> 1) & east | \
+            (reached & south) << width | (reached >> width) & south
+        if grown == reached:
+            return False
+        reached = grown
+
+    return True
+
+
 def rowDistance(cell, row, boardSize):
     cellRow = cell / boardSize
     return abs(row - cellRow)
@@ -1,7 +1,39 @@
 __author__ = 'MQC1472'
 from math import sqrt, log
+import multiprocessing
+import Queue
 import random
+import threading
 import time
+import traceback
+
+# How many iterations pass between checks for an early stop
+EARLY_STOP_INTERVAL = 100
+
+# The reward each rollout still in flight is assumed to have lost, see
+# MCTSNode.uct
+VIRTUAL_LOSS = 1
+
+class RolloutPolicy(object):
+    """
+    Chooses the moves of a rollout and decides where it ends. This policy
+    plays uniformly random moves; subclasses override selectMove with
+    something better informed.
+
+    With maxMoves, a rollout that has not ended after that many moves is
+    cut off and scored by evaluate(gamestate, player), which must return
+    the expected reward of the given player (1 or 2) in the position, from
+    -1 for a certain loss to 1 for a certain win. Policies are pickled for
+    the parallel searches, so evaluate should be a module level function.
+    """
+
+    def __init__(self, maxMoves=None, evaluate=None):
+        assert maxMoves is None or evaluate is not None
+        self.maxMoves = maxMoves
+        self.evaluate = evaluate
+
+    def selectMove(self, gamestate):
+        return randomMove(gamestate)
 
 class MCTSNode(object):
 
@@ -11,48 +43,474 @@ class MCTSNode(object):
         self.move = move
         self.visits = 0
         self.value = 0
-        self.children = []
+        self.pending = 0
+        self.children = {}
+
+        # The exact reward of the position once a solver has proven it, see
+        # solveLeaf
+        self.provenValue = None
+
+        # The untried moves are only generated when the node is first
+        # expanded, see _prepareFrontier
+        self.untriedMoves = None
+        self.untriedCandidates = []
+
+        # For a node loaded from a tree file, the file, the node's index in
+        # it and whether the node holds the mirror image of the stored
+        # position, until its children have been read (see
+        # _loadStoredChildren)
+        self.stored = None
+
+    def _prepareFrontier(self, gamestate):
+        # Game states that can list candidate moves cheaply and check them one
+        # by one (getMoveCandidates and isLegalCandidate) have each candidate
+        # checked only when it is about to be expanded. The others have their
+        # legal moves generated at once. Either way moves are tried in random
+        # order.
+        if self.untriedMoves is not None:
+            return
+
+        self._loadStoredChildren(gamestate)
+
+        if hasattr(gamestate, 'getMoveCandidates'):
+            self.untriedMoves = []
+            self.untriedCandidates = gamestate.getMoveCandidates()
+            if self.children:
+                self.untriedCandidates = [move for move in
+                                          self.untriedCandidates
+                                          if move not in self.children]
+            random.shuffle(self.untriedCandidates)
+        else:
+            self.untriedMoves = gamestate.getLegalMoves()
+            if self.children:
+                self.untriedMoves = [move for move in self.untriedMoves
+                                     if move not in self.children]
+            random.shuffle(self.untriedMoves)
+
+    def _loadStoredChildren(self, gamestate):
+        # A node loaded from a tree file (see treefile.loadTree) reads its
+        # children from the file the first time they are needed. The
+        # gamestate must be the position at this node.
+        if self.stored is None:
+            return
 
-        self.frontier = self.gamestate.getLegalMoves()
-        random.shuffle(self.frontier)
+        storedTree, index, mirrored = self.stored
+        self.stored = None
+        for move, childIndex in storedTree.edges(index):
+            if mirrored:
+                move = gamestate.mirrorMove(move)
+            self._addStoredChild(move, gamestate, storedTree, childIndex)
 
-    def isFullyExpanded(self):
-        return self.frontier == []
+    def _addStoredChild(self, move, gamestate, storedTree, index):
+        newGameState = self.gamestate.copy()
+        newGameState.executeMove(move)
+        newNode = MCTSNode(newGameState, self, move)
+        storedTree.restore(newNode, index)
+        self.children[move] = newNode
+
+    def _nextUntriedMove(self, gamestate):
+        # The move the next expansion will try, or None if every legal move
+        # has been tried. The gamestate must be the position at this node.
+        self._prepareFrontier(gamestate)
+        while not self.untriedMoves and self.untriedCandidates:
+            move = self.untriedCandidates.pop()
+            if gamestate.isLegalCandidate(move):
+                self.untriedMoves.append(move)
+
+        return self.untriedMoves[-1] if self.untriedMoves else None
+
+    def _popUntriedMove(self, gamestate):
+        move = self._nextUntriedMove(gamestate)
+        assert move is not None
+        return self.untriedMoves.pop()
+
+    @property
+    def frontier(self):
+        """
+        The list of legal moves not expanded yet. This checks every remaining
+        candidate move, so it is meant for the root, and only works on nodes
+        that keep their game state.
+        """
+
+        self._prepareFrontier(self.gamestate)
+        while self.untriedCandidates:
+            move = self.untriedCandidates.pop()
+            if self.gamestate.isLegalCandidate(move):
+                self.untriedMoves.append(move)
+
+        return self.untriedMoves
+
+    def isFullyExpanded(self, gamestate=None):
+        # A gamestate must be given for nodes without one of their own
+        if gamestate is None:
+            gamestate = self.gamestate
+        return self._nextUntriedMove(gamestate) is None
 
     def selectBestChild(self):
-        assert self.children != []
-        return max(self.children, key=self.uct)
+        assert self.children != {}
+        return max(self.children.itervalues(), key=self.uct)
 
     def selectBestMove(self):
-        bestChild = max(self.children,
-                   key=lambda child: float(child.value) / float(child.visits))
-        print "Best Child Value: ", str(bestChild.value)
-        print "Best Child Visits: ", str(bestChild.visits)
-        return bestChild.move
+        return selectBestMoveFromStatistics(self.rootStatistics(),
+                                            self.gamestate)
+
+    def rootStatistics(self):
+        """
+        Returns a dictionary mapping each expanded move to the (visits, value)
+        pair of its child.
+        """
+
+        return dict((move, (child.visits, child.value))
+                    for move, child in self.children.iteritems())
 
     def isTerminal(self):
         return self.gamestate.winner is not None
 
     def expand(self):
-        assert self.frontier != []
-        randomMove = self.frontier.pop()
+        randomMove = self._popUntriedMove(self.gamestate)
         newGameState = self.gamestate.copy()
         newGameState.executeMove(randomMove)
         newNode = MCTSNode(newGameState, self, randomMove)
-        self.children.append(newNode)
+        self.children[randomMove] = newNode
 
         return newNode
 
+    def getChild(self, move):
+        """
+        Returns the child reached by playing the given move. A move the search
+        has not tried yet gets a new node that is not attached to this one,
+        since every child in the tree must have been visited (see uct).
+        """
+
+        self._loadStoredChildren(self.gamestate)
+        if move in self.children:
+            return self.children[move]
+
+        newGameState = self.gamestate.copy()
+        newGameState.executeMove(move)
+        return MCTSNode(newGameState, None, move)
+
+    def reroot(self, move):
+        """
+        Promotes the child reached by the given move to be the root of a new
+        search tree. The statistics of the retained subtree are kept so the
+        next search starts from them instead of from scratch. Works for
+        either player's move, as long as it is legal in this node's state.
+        """
+
+        newRoot = self.getChild(move)
+        newRoot.parent = None
+
+        return newRoot
+
     def uct(self, node):
-        w = float(node.value)
-        n = float(node.visits)
+        # Rollouts still in flight count as visits that were lost (a virtual
+        # loss), so that parallel searches spread out instead of piling onto
+        # the same leaf
+        w = float(node.value - VIRTUAL_LOSS * node.pending)
+        n = float(node.visits + node.pending)
         C = sqrt(2)
-        N = float(self.visits)
+        N = float(self.visits + self.pending)
 
         uct = w / n + C * sqrt(log(N) / n)
 
         return uct
 
+class StatelessMCTSNode(MCTSNode):
+    """
+    A tree node that stores only the move leading to it. The root keeps its
+    game state; every other position is rebuilt during selection by playing
+    the moves along the path into a single scratch copy of the root state
+    (see selectStateless). This trades a few executeMove calls per iteration
+    for not keeping a game state copy in every node.
+    """
+
+    def __init__(self, gamestate, parent = None, move = None):
+        # The gamestate passed in is the position at this node. It is only
+        # kept by the root; other nodes just read what they need from it.
+        self.gamestate = gamestate if parent is None else None
+        self.parent = parent
+        self.move = move
+        self.visits = 0
+        self.value = 0
+        self.pending = 0
+        self.children = {}
+        self.provenValue = None
+        self.terminal = gamestate.winner is not None
+        self.untriedMoves = None
+        self.untriedCandidates = []
+        self.stored = None
+
+    def isTerminal(self):
+        return self.terminal
+
+    def expand(self, gamestate):
+        """
+        Expands a random untried move. The gamestate must be the position at
+        this node and is advanced to the position at the new child.
+        """
+
+        randomMove = self._popUntriedMove(gamestate)
+        gamestate.executeMove(randomMove)
+        newNode = StatelessMCTSNode(gamestate, self, randomMove)
+        self.children[randomMove] = newNode
+
+        return newNode
+
+    def _addStoredChild(self, move, gamestate, storedTree, index):
+        tracked = enableUndo(gamestate)
+        gamestate.executeMove(move)
+        newNode = StatelessMCTSNode(gamestate, self, move)
+        gamestate.undoMove()
+        if not tracked:
+            gamestate.trackUndo = False
+        storedTree.restore(newNode, index)
+        self.children[move] = newNode
+
+    def getChild(self, move):
+        # Only valid on a node holding its game state, i.e. the root
+        self._loadStoredChildren(self.gamestate)
+        if move in self.children:
+            return self.children[move]
+
+        newGameState = self.gamestate.copy()
+        newGameState.executeMove(move)
+        return StatelessMCTSNode(newGameState, None, move)
+
+    def reroot(self, move):
+        newRoot = self.getChild(move)
+        newRoot.gamestate = self.gamestate.copy()
+        newRoot.gamestate.executeMove(move)
+        newRoot.parent = None
+
+        return newRoot
+
+class TranspositionTable(object):
+    """
+    Maps position hashes to tree nodes, so that a position reached by
+    different move orders is represented by a single node. With symmetric
+    set, a position also shares its node with its mirror image; this needs
+    game states that track a mirrorHash, as the Connect Four states do, and
+    to load a saved tree also a mirrorMove method.
+    """
+
+    def __init__(self, symmetric=False):
+        self.symmetric = symmetric
+        self.nodes = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def key(self, gamestate):
+        if self.symmetric:
+            return min(gamestate.hash, gamestate.mirrorHash)
+        return gamestate.hash
+
+    def retain(self, root):
+        """
+        Drops every node that is no longer reachable from the root. A kept
+        node whose first parent is dropped loses its parent link, which
+        would otherwise keep the dropped part of the tree alive.
+        """
+
+        self.nodes = {}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            key = self.key(node.gamestate)
+            if key not in self.nodes:
+                self.nodes[key] = node
+                stack.extend(node.children.itervalues())
+
+        for node in self.nodes.itervalues():
+            parent = node.parent
+            if (parent is not None and
+                    self.nodes.get(self.key(parent.gamestate)) is not parent):
+                node.parent = None
+
+class TranspositionMCTSNode(MCTSNode):
+    """
+    A node of a search DAG. New children are looked up in the transposition
+    table first and shared if the position is already in the tree, so their
+    statistics are pooled over every path that reaches them.
+
+    Since a node can have several parents, its parent attribute is only the
+    first one. Statistics must be backed up along the path actually taken
+    (see selectPath and backpropagatePath), which search does.
+    """
+
+    def __init__(self, gamestate, parent = None, move = None, table = None):
+        MCTSNode.__init__(self, gamestate, parent, move)
+        self.table = table if table is not None else TranspositionTable()
+
+        if parent is None:
+            self.table.nodes.setdefault(self.table.key(gamestate), self)
+
+    def expand(self):
+        return self._addChild(self._popUntriedMove(self.gamestate))
+
+    def getChild(self, move):
+        self._loadStoredChildren(self.gamestate)
+        if move in self.children:
+            return self.children[move]
+
+        # A position already in the table has been visited through another
+        # parent and can be shared as it is
+        newGameState = self.gamestate.copy()
+        newGameState.executeMove(move)
+        newNode = self.table.nodes.get(self.table.key(newGameState))
+        if newNode is None:
+            newNode = TranspositionMCTSNode(newGameState, None, move,
+                                            self.table)
+        return newNode
+
+    def _addStoredChild(self, move, gamestate, storedTree, index):
+        # A position already in the table has been loaded through another
+        # parent and keeps its node. A new node may hold the mirror image of
+        # the position it was saved with, whose stored moves must then be
+        # mirrored as well.
+        numNodes = len(self.table)
+        newNode = self._addChild(move)
+        if len(self.table) > numNodes:
+            storedTree.restore(newNode, index, newNode.gamestate.hash !=
+                               storedTree.hash(index))
+
+    def _addChild(self, move):
+        newGameState = self.gamestate.copy()
+        newGameState.executeMove(move)
+
+        key = self.table.key(newGameState)
+        newNode = self.table.nodes.get(key)
+        if newNode is None:
+            newNode = TranspositionMCTSNode(newGameState, self, move,
+                                            self.table)
+            self.table.nodes[key] = newNode
+
+        self.children[move] = newNode
+
+        return newNode
+
+    def reroot(self, move):
+        newRoot = self.getChild(move)
+
+        # A child shared with the mirror image of the actual position is
+        # turned around, so the real game's moves can be played from it
+        gamestate = self.gamestate.copy()
+        gamestate.executeMove(move)
+        if newRoot.gamestate.hash != gamestate.hash:
+            newRoot._mirror(gamestate)
+
+        newRoot.move = move
+        newRoot.parent = None
+        self.table.retain(newRoot)
+
+        return newRoot
+
+    def _mirror(self, gamestate):
+        # Makes this node hold gamestate, the mirror image of its position,
+        # with every move out of it mirrored to match. Its children stay
+        # as they are, as the table shares them with their mirror images.
+        mirrorMove = gamestate.mirrorMove
+        self.gamestate = gamestate
+        self.children = dict((mirrorMove(move), child)
+                             for move, child in self.children.iteritems())
+        if self.untriedMoves is not None:
+            self.untriedMoves = [mirrorMove(move)
+                                 for move in self.untriedMoves]
+            self.untriedCandidates = [mirrorMove(move)
+                                      for move in self.untriedCandidates]
+        if self.stored is not None:
+            storedTree, index, mirrored = self.stored
+            self.stored = (storedTree, index, not mirrored)
+
+class SearchStats(object):
+    """
+    Counters and timers collected by a search when passed as its stats.
+    Times are processor seconds; phaseTimes has 'select', 'simulate' and
+    'backpropagate' entries, and moveSelectionTimes and moveSelectionCalls
+    cover choosing each rollout move (the rollout policy's selectMove, or
+    randomMove), keyed by game state class.
+
+    With a callback, a snapshot (see snapshot) is passed to it every
+    snapshotInterval iterations, so a long search can be watched while it
+    runs. The counters accumulate over every search the object is passed
+    to; use a new SearchStats per move to get per-move figures.
+
+    Timing every rollout move slows the rollouts of cheap games noticeably
+    (about 20% for tic-tac-toe); timeMoveSelection turns it off.
+    """
+
+    def __init__(self, callback=None, snapshotInterval=1000,
+                 timeMoveSelection=True):
+        self.callback = callback
+        self.snapshotInterval = snapshotInterval
+        self.timeMoveSelection = timeMoveSelection
+
+        self.iterations = 0
+        self.nodesCreated = 0
+        self.totalDepth = 0
+        self.maxDepth = 0
+        self.rollouts = 0
+        self.rolloutMoves = 0
+        self.phaseTimes = {'select': 0.0, 'simulate': 0.0,
+                           'backpropagate': 0.0}
+        self.moveSelectionTimes = {}
+        self.moveSelectionCalls = {}
+
+    def addIteration(self, path):
+        # A leaf that has never been backed up was created by this iteration
+        if path[-1].visits == 0:
+            self.nodesCreated += 1
+
+        depth = len(path) - 1
+        self.totalDepth += depth
+        self.maxDepth = max(self.maxDepth, depth)
+
+        self.iterations += 1
+        if self.callback is not None and \
+                self.iterations % self.snapshotInterval == 0:
+            self.callback(self.snapshot())
+
+    def addRollout(self, moves):
+        self.rollouts += 1
+        self.rolloutMoves += moves
+
+    def addMoveSelectionTime(self, gamestate, seconds):
+        name = type(gamestate).__name__
+        self.moveSelectionTimes[name] = \
+            self.moveSelectionTimes.get(name, 0.0) + seconds
+        self.moveSelectionCalls[name] = \
+            self.moveSelectionCalls.get(name, 0) + 1
+
+    def snapshot(self):
+        """
+        Returns the current figures as a dictionary, with the mean tree
+        depth and rollout length worked out.
+        """
+
+        return {
+            'iterations': self.iterations,
+            'nodesCreated': self.nodesCreated,
+            'meanDepth': float(self.totalDepth) / max(self.iterations, 1),
+            'maxDepth': self.maxDepth,
+            'rollouts': self.rollouts,
+            'meanRolloutLength': float(self.rolloutMoves) /
+                                 max(self.rollouts, 1),
+            'phaseTimes': dict(self.phaseTimes),
+            'moveSelectionTimes': dict(self.moveSelectionTimes),
+            'moveSelectionCalls': dict(self.moveSelectionCalls),
+        }
+
+    def __str__(self):
+        snapshot = self.snapshot()
+        return "%d iterations, %d nodes, depth %.1f mean %d max, " \
+            "rollout length %.1f, select %.3fs simulate %.3fs " \
+            "backpropagate %.3fs" % (
+                snapshot['iterations'], snapshot['nodesCreated'],
+                snapshot['meanDepth'], snapshot['maxDepth'],
+                snapshot['meanRolloutLength'], self.phaseTimes['select'],
+                self.phaseTimes['simulate'], self.phaseTimes['backpropagate'])
+
 def select(node):
 
     if node.isTerminal():
@@ -62,7 +520,82 @@ def select(node):
     else:
         return node.expand()
 
-def simulate(node):
+def selectStateless(root, gamestate):
+    """
+    Selection for a StatelessMCTSNode tree. The gamestate must be a scratch
+    copy of the root's state; the moves on the way down are played into it,
+    so on return it holds the position at the returned node.
+    """
+
+    return selectPath(root, gamestate)[-1]
+
+def selectPath(root, gamestate=None):
+    """
+    Selects a leaf like select, but iteratively, and returns the list of
+    nodes from the root down to the leaf. For a StatelessMCTSNode tree pass
+    a scratch copy of the root's state as gamestate, as for selectStateless.
+
+    In a DAG the descent can come back to a node already on the path (e.g.
+    a repeated Quoridor position); the descent stops there so that no node
+    is counted twice. It also stops at a node below the root whose value has
+    been proven (see solveLeaf), as searching its subtree cannot change it.
+    """
+
+    path = [root]
+    node = root
+
+    while not node.isTerminal():
+        if node.provenValue is not None and node is not root:
+            break
+
+        if not node.isFullyExpanded(gamestate):
+            if gamestate is None:
+                child = node.expand()
+            else:
+                child = node.expand(gamestate)
+            if child not in path:
+                path.append(child)
+            break
+
+        child = node.selectBestChild()
+        if child in path:
+            break
+        if gamestate is not None:
+            gamestate.executeMove(child.move)
+
+        path.append(child)
+        node = child
+
+    return path
+
+def solveLeaf(node, gamestate, solver):
+    """
+    Returns the exact reward of the node's position, whose gamestate is
+    given, if the solver can prove it, and None otherwise. A proven node
+    keeps its value, so selection stops there from then on.
+    """
+
+    if node.provenValue is None:
+        node.provenValue = solver.solve(gamestate)
+
+    return node.provenValue
+
+def simulate(node, stats=None, policy=None):
+    return rollout(node.gamestate.copy(), stats, policy)
+
+def rollout(gamestate, stats=None, policy=None):
+    """
+    Plays random moves from the given gamestate until the game ends and
+    returns the reward. The gamestate is modified in place. With stats (see
+    SearchStats), the rollout length and move selection time are recorded.
+
+    A policy (see RolloutPolicy) chooses the moves instead, and may cut the
+    rollout short and score the position where it stopped.
+
+    Game states with a getDecidedWinner method are asked before every move
+    whether the outcome is already settled; if so the rollout ends there
+    with that result, as if the game had been played out.
+    """
 
     # TODO: Make this section more clear. 'currentplayer' is confusing
     # TODO: and reward values are confusing
@@ -71,65 +604,539 @@ def simulate(node):
     # We want to evaluate the reward from the perspective of the player
     # WHO JUST MOVED, not the player about to move.
 
-    gamestate = node.gamestate.copy()
     currentPlayer = gamestate.currentPlayer
 
+    selectMove = randomMove if policy is None else policy.selectMove
+    maxMoves = None if policy is None else policy.maxMoves
+    getDecidedWinner = getattr(gamestate, 'getDecidedWinner', None)
+
     simulatedMoves = 0
+    winner = gamestate.winner
 
-    while gamestate.winner is None:
-        start = time.clock()
-        legalMoves = gamestate.getLegalMoves()
-        end = time.clock()
-        # print "Legal Move Time: ", str(end - start)
-        move = random.choice(legalMoves)
+    while winner is None:
+        if getDecidedWinner is not None:
+            winner = getDecidedWinner()
+            if winner is not None:
+                break
+
+        if simulatedMoves == maxMoves:
+            if stats is not None:
+                stats.addRollout(simulatedMoves)
+            return policy.evaluate(gamestate, 3 - currentPlayer)
+
+        if stats is None or not stats.timeMoveSelection:
+            move = selectMove(gamestate)
+        else:
+            start = time.clock()
+            move = selectMove(gamestate)
+            stats.addMoveSelectionTime(gamestate, time.clock() - start)
         gamestate.executeMove(move)
         simulatedMoves += 1
+        winner = gamestate.winner
 
-    # print "Simulated moves played: ", str(simulatedMoves)
+    if stats is not None:
+        stats.addRollout(simulatedMoves)
 
-    if gamestate.winner == 0:
+    if winner == 0:
         reward = 0
-    elif gamestate.winner == 1 and currentPlayer == 1:
+    elif winner == 1 and currentPlayer == 1:
         reward = -1
-    elif gamestate.winner == 2 and currentPlayer == 2:
+    elif winner == 2 and currentPlayer == 2:
         reward = -1
     else:
         reward = 1
 
     return reward
 
-def backpropagate(node, reward):
+def randomMove(gamestate):
+    # Game states that can draw a uniformly random legal move without
+    # generating all of them (sampleRandomLegalMove) are left to do so
+    if hasattr(gamestate, 'sampleRandomLegalMove'):
+        return gamestate.sampleRandomLegalMove()
+    return random.choice(gamestate.getLegalMoves())
+
+def enableUndo(gamestate):
+    """
+    Makes the gamestate record what undoMove needs for the moves made on it
+    from now on, and returns whether it already did. Game states that only
+    keep this record on request have a trackUndo attribute, as every game
+    state here does; the others are assumed to always keep it.
+    """
+
+    tracked = getattr(gamestate, 'trackUndo', True)
+    if not tracked:
+        gamestate.trackUndo = True
+    return tracked
 
-    node.visits += 1
+def backpropagate(node, reward, visits=1):
+
+    # A leaf scored with several rollouts at once passes their summed reward
+    # along with the number of rollouts
+    node.visits += visits
     node.value += reward
 
     if node.parent:
-        backpropagate(node.parent, -reward)
+        backpropagate(node.parent, -reward, visits)
+
+def backpropagatePath(path, reward, visits=1):
+
+    for node in reversed(path):
+        node.visits += visits
+        node.value += reward
+        reward = -reward
+
+def isSearchDecided(root, remainingIterations):
+    """
+    Returns True if no amount of further search can change which root child
+    is the most visited: either there is only a single legal move, or the
+    runner-up could not catch up even if it received every remaining
+    iteration.
+    """
+
+    visits = [child.visits for child in root.children.itervalues()]
+    visits += [0] * len(root.frontier)
+
+    if len(visits) < 2:
+        return True
+
+    visits.sort(reverse=True)
+
+    return visits[0] - visits[1] > remainingIterations
+
+def addPending(node, count):
+    """
+    Adds count in-flight rollouts to the node and all of its ancestors.
+    """
+
+    while node is not None:
+        node.pending += count
+        node = node.parent
+
+def addVirtualLoss(path, count):
+    """
+    Adds count in-flight rollouts to every node on the path, as returned by
+    selectPath. Unlike addPending this follows the path actually taken, so
+    it also works for DAG (transposition) trees.
+    """
+
+    for node in path:
+        node.pending += count
+
+def mcts(root, iterations=None, timeLimit=None, earlyStop=False,
+         unmake=False, solver=None, stats=None, policy=None):
+    """
+    Searches from the root and returns the best move found. See search for
+    the meaning of the other arguments.
+    """
 
-def mcts(root, iterations):
+    if earlyStop and len(root.frontier) + len(root.children) == 1:
+        return (root.frontier + root.children.keys())[0]
+
+    search(root, iterations, timeLimit, earlyStop, unmake, solver, stats,
+           policy)
+
+    best_move = root.selectBestMove()
+
+    return best_move
+
+def search(root, iterations=None, timeLimit=None, earlyStop=False,
+           unmake=False, solver=None, stats=None, policy=None):
+    """
+    Grows the tree under the root and returns the number of iterations
+    performed. The search runs until the iteration budget is used up or
+    timeLimit seconds of wall-clock time have passed, whichever comes first.
+    At least one of the two budgets must be given.
+
+    With earlyStop the search also ends as soon as the decision is settled
+    (see isSearchDecided). mcts additionally answers a root with a single
+    legal move without searching at all.
+
+    With unmake, a StatelessMCTSNode search plays each iteration directly on
+    the root's game state and takes every move back with undoMove afterwards,
+    instead of copying the root state once per iteration. The game state
+    must support undoMove, and is left recording undo information (see
+    enableUndo).
+
+    With a solver (see solver.ExactSolver), a leaf whose position the solver
+    can prove is scored with its exact value instead of a rollout, and the
+    search no longer descends below it.
+
+    With stats, a SearchStats, the search records its counters and phase
+    times there. With unmake, taking the moves back counts as simulation.
+
+    With a policy (see RolloutPolicy), the rollouts follow it instead of
+    playing uniformly random moves.
+    """
+
+    assert iterations is not None or timeLimit is not None
+
+    stateless = isinstance(root, StatelessMCTSNode)
+    assert stateless or not unmake
+    if unmake:
+        enableUndo(root.gamestate)
+
+    startTime = time.time()
+    deadline = None if timeLimit is None else startTime + timeLimit
 
     i = 0
 
-    while i < iterations:
-        # print 'Iteration: ', str(i)
+    while iterations is None or i < iterations:
+        if deadline is not None and time.time() >= deadline:
+            break
+
+        if earlyStop and i > 0 and i % EARLY_STOP_INTERVAL == 0:
+            remaining = _remainingIterations(i, iterations, startTime,
+                                             deadline)
+            if isSearchDecided(root, remaining):
+                break
+
+        if unmake:
+            path, reward = _unmakeIteration(root, solver, stats, policy)
+        else:
+            start = time.clock()
+            if stateless:
+                gamestate = root.gamestate.copy()
+                path = selectPath(root, gamestate)
+            else:
+                path = selectPath(root)
+                gamestate = path[-1].gamestate
+            end = time.clock()
+            _addPhaseTime(stats, 'select', end - start)
+
+            start = time.clock()
+            reward = None
+            if solver is not None:
+                reward = solveLeaf(path[-1], gamestate, solver)
+            if reward is None:
+                if stateless:
+                    reward = rollout(gamestate, stats, policy)
+                else:
+                    reward = simulate(path[-1], stats, policy)
+            end = time.clock()
+            _addPhaseTime(stats, 'simulate', end - start)
+
+        if stats is not None:
+            stats.addIteration(path)
 
         start = time.clock()
-        node = select(root)
+        backpropagatePath(path, reward)
         end = time.clock()
-        # print "Selection time: ", str(end - start)
+        _addPhaseTime(stats, 'backpropagate', end - start)
+
+        i += 1
+
+    return i
 
+def _unmakeIteration(root, solver, stats, policy):
+    # Selection and rollout on the root's own game state. The moves are
+    # taken back even if the rollout fails, so the root state stays valid.
+    gamestate = root.gamestate
+    depth = len(gamestate.moveStack)
+
+    try:
         start = time.clock()
-        reward = simulate(node)
+        path = selectPath(root, gamestate)
         end = time.clock()
-        # print "Simulation time: ", str(end - start)
+        _addPhaseTime(stats, 'select', end - start)
 
         start = time.clock()
-        backpropagate(node, reward)
+        reward = None
+        if solver is not None:
+            reward = solveLeaf(path[-1], gamestate, solver)
+        if reward is None:
+            reward = rollout(gamestate, stats, policy)
+    finally:
+        while len(gamestate.moveStack) > depth:
+            gamestate.undoMove()
         end = time.clock()
-        # print "Backprop time: ", str(end - start)
+        _addPhaseTime(stats, 'simulate', end - start)
 
-        i += 1
+    return path, reward
 
-    best_move = root.selectBestMove()
+def _addPhaseTime(stats, phase, seconds):
+    if stats is not None:
+        stats.phaseTimes[phase] += seconds
+
+def _remainingIterations(i, iterations, startTime, deadline):
+    # Estimates how many more iterations the budget allows. For a deadline
+    # the estimate extrapolates the iteration rate observed so far.
+
+    remaining = float('inf')
+
+    if iterations is not None:
+        remaining = iterations - i
+
+    if deadline is not None:
+        now = time.time()
+        rate = i / max(now - startTime, 1e-9)
+        remaining = min(remaining, rate * (deadline - now))
+
+    return remaining
+
+def selectBestMoveFromStatistics(statistics, gamestate=None):
+    """
+    Picks the most visited move from a dictionary mapping moves to (visits,
+    value) pairs, as returned by rootStatistics, breaking ties by average
+    value. This is the move isSearchDecided checks, and unlike the highest
+    average it is never a barely visited move with a few lucky rollouts.
+
+    If no move has been visited, e.g. when the time ran out before the
+    first iteration, a random legal move of the gamestate (the searched
+    position) is returned instead, or ValueError raised without one.
+    """
+
+    visited = [(move, stats) for move, stats in statistics.iteritems()
+               if stats[0]]
+    if not visited:
+        if gamestate is None:
+            raise ValueError("No move has been searched")
+        return randomMove(gamestate)
+
+    bestMove, (visits, value) = max(
+        visited,
+        key=lambda item: (item[1][0], float(item[1][1]) / float(item[1][0])))
+    return bestMove
+
+def mergeStatistics(statisticsList):
+    """
+    Sums per-move visits and values over several root statistics
+    dictionaries, e.g. from independently searched trees.
+    """
+
+    merged = {}
+    for statistics in statisticsList:
+        for move, (visits, value) in statistics.iteritems():
+            totalVisits, totalValue = merged.get(move, (0, 0))
+            merged[move] = (totalVisits + visits, totalValue + value)
+
+    return merged
+
+def _rootParallelWorker(args):
+    gamestate, iterations, timeLimit, seed, nodeClass, policy = args
+
+    # Forked workers inherit the parent's random state, so every tree must be
+    # reseeded or they would all play the same rollouts
+    random.seed(seed)
+
+    root = nodeClass(gamestate)
+    search(root, iterations, timeLimit, policy=policy)
+
+    return root.rootStatistics()
+
+def rootParallelMCTS(gamestate, iterations=None, timeLimit=None, numTrees=None,
+                     pool=None, nodeClass=MCTSNode, policy=None):
+    """
+    Root-parallel search: grows numTrees independent trees from the same
+    gamestate in a process pool, each with its own seed, and merges the
+    visits and values of their root children before picking the best move.
+
+    The iteration budget is shared between the trees, so the total amount of
+    search matches a single mcts call with the same budget. A time limit
+    applies to each tree. Pass a pool to reuse worker processes between
+    moves; otherwise one is created for this call and one tree is grown per
+    CPU. nodeClass selects the kind of tree each worker grows, and policy
+    the rollout policy of every tree (see RolloutPolicy).
+    """
+
+    assert iterations is not None or timeLimit is not None
+
+    if numTrees is None:
+        numTrees = multiprocessing.cpu_count()
+
+    treeIterations = None
+    if iterations is not None:
+        treeIterations = max(1, -(-iterations // numTrees))
+
+    jobs = [(gamestate, treeIterations, timeLimit, random.getrandbits(32),
+             nodeClass, policy)
+            for _ in xrange(numTrees)]
+
+    ownPool = pool is None
+    if ownPool:
+        pool = multiprocessing.Pool(numTrees)
+
+    try:
+        statisticsList = pool.map(_rootParallelWorker, jobs)
+    finally:
+        if ownPool:
+            pool.close()
+            pool.join()
+
+    return selectBestMoveFromStatistics(mergeStatistics(statisticsList),
+                                        gamestate)
+
+def _seedWorker():
+    random.seed()
+
+def _rolloutWorker(gamestate, policy=None):
+    # Exceptions are handed back to the caller, as apply_async callbacks are
+    # never run for a failed task and the search would wait forever
+    try:
+        return rollout(gamestate, policy=policy), None
+    except Exception:
+        return None, traceback.format_exc()
+
+def leafParallelMCTS(root, iterations=None, timeLimit=None, numWorkers=None,
+                     maxInFlight=None, pool=None, policy=None):
+    """
+    Leaf-parallel search: this process selects, expands and backpropagates
+    while the rollouts run in a process pool. Up to maxInFlight leaves are
+    simulated at once; each is marked pending until its result comes back,
+    which steers selection away from it in the meantime. Results are backed
+    up in the order they complete.
+
+    The budgets and the rollout policy mean the same as for search. When
+    the budget runs out no new rollouts are started, but those in flight are
+    still backed up. Pending counts follow parent links, so DAG
+    (transposition) trees are not supported.
+    """
+
+    assert iterations is not None or timeLimit is not None
+    assert not isinstance(root, TranspositionMCTSNode)
+
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    if maxInFlight is None:
+        maxInFlight = 2 * numWorkers
+
+    ownPool = pool is None
+    if ownPool:
+        pool = multiprocessing.Pool(numWorkers, _seedWorker)
+
+    stateless = isinstance(root, StatelessMCTSNode)
+    deadline = None if timeLimit is None else time.time() + timeLimit
+    completed = Queue.Queue()
+    inFlight = 0
+    dispatched = 0
+
+    try:
+        while True:
+            while inFlight < maxInFlight and \
+                    (iterations is None or dispatched < iterations) and \
+                    (deadline is None or time.time() < deadline):
+                if stateless:
+                    gamestate = root.gamestate.copy()
+                    node = selectStateless(root, gamestate)
+                else:
+                    node = select(root)
+                    gamestate = node.gamestate
+                dispatched += 1
+
+                if node.isTerminal():
+                    backpropagate(node, rollout(gamestate.copy()))
+                    continue
+
+                addPending(node, 1)
+                pool.apply_async(
+                    _rolloutWorker, (gamestate, policy),
+                    callback=lambda result, node=node: completed.put(
+                        (node, result)))
+                inFlight += 1
+
+            if inFlight == 0:
+                break
+
+            node, (reward, error) = completed.get()
+            inFlight -= 1
+
+            if error is not None:
+                raise RuntimeError("Rollout failed in worker:\n" + error)
+
+            addPending(node, -1)
+            backpropagate(node, reward)
+    finally:
+        if ownPool:
+            pool.terminate()
+            pool.join()
+
+    return root.selectBestMove()
+
+def treeParallelMCTS(root, iterations=None, timeLimit=None, numWorkers=None,
+                     pool=None, threadRollouts=False, policy=None):
+    """
+    Tree-parallel search: numWorkers threads grow the one tree under the
+    root. Each worker selects a path under a lock and marks it with a
+    virtual loss (see addVirtualLoss and MCTSNode.uct), so the others are
+    steered elsewhere while its rollout runs outside the lock; the loss is
+    reverted when the result is backed up.
+
+    Python threads do not run Python code in parallel, so the rollouts are
+    handed to a process pool, one process per worker unless a pool is
+    passed in. With threadRollouts they run in the worker threads instead,
+    which only helps if the rollout releases the interpreter lock.
+
+    The budgets and the rollout policy mean the same as for search. Any
+    kind of tree is supported.
+    """
+
+    assert iterations is not None or timeLimit is not None
+
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+
+    ownPool = pool is None and not threadRollouts
+    if ownPool:
+        pool = multiprocessing.Pool(numWorkers, _seedWorker)
+
+    stateless = isinstance(root, StatelessMCTSNode)
+    deadline = None if timeLimit is None else time.time() + timeLimit
+    lock = threading.Lock()
+    state = {'dispatched': 0, 'errors': []}
+
+    def claimIteration():
+        # Called with the lock held
+        if state['errors']:
+            return False
+        if iterations is not None and state['dispatched'] >= iterations:
+            return False
+        if deadline is not None and time.time() >= deadline:
+            return False
+        state['dispatched'] += 1
+        return True
+
+    def work():
+        try:
+            while True:
+                with lock:
+                    if not claimIteration():
+                        return
+                    if stateless:
+                        gamestate = root.gamestate.copy()
+                        path = selectPath(root, gamestate)
+                    else:
+                        path = selectPath(root)
+                        gamestate = path[-1].gamestate.copy()
+                    addVirtualLoss(path, 1)
+
+                if threadRollouts or gamestate.winner is not None:
+                    reward = rollout(gamestate, policy=policy)
+                else:
+                    reward, error = pool.apply(_rolloutWorker,
+                                               (gamestate, policy))
+                    if error is not None:
+                        raise RuntimeError("Rollout failed in worker:\n" +
+                                           error)
+
+                with lock:
+                    addVirtualLoss(path, -1)
+                    backpropagatePath(path, reward)
+        except Exception:
+            with lock:
+                state['errors'].append(traceback.format_exc())
+
+    workers = [threading.Thread(target=work) for _ in xrange(numWorkers)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        if ownPool:
+            pool.terminate()
+            pool.join()
+
+    if state['errors']:
+        raise RuntimeError("Tree-parallel worker failed:\n" +
+                           state['errors'][0])
 
-    return best_move
\ No newline at end of file
+    return root.selectBestMove()
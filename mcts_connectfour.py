@@ -1,37 +1,98 @@
+import os
 
 import mcts
 import connectfour
+import openingbook
+import policies
+import solver
+import treefile
+
+# Positions with at most this many empty cells are solved exactly
+SOLVER_EMPTY_CELLS = 12
+
+# The search tree of the first position out of the book is kept here
+# between runs
+TREE_FILE = 'connectfour.tree'
+
+# Built with python openingbook.py connectfour
+BOOK_FILE = 'connectfour.book'
+
+def openBook():
+    if os.path.exists(BOOK_FILE):
+        return openingbook.OpeningBook(BOOK_FILE)
+    return None
+
+def loadSearchTree(cf):
+    # Book moves are played without searching, so the saved tree starts at
+    # the first position the book does not cover. A tree saved with another
+    # book holds another position and is searched over from scratch.
+    table = mcts.TranspositionTable(symmetric=True)
+    if os.path.exists(TREE_FILE):
+        try:
+            root = treefile.loadTree(TREE_FILE, cf.copy(),
+                                     mcts.TranspositionMCTSNode, table)
+            print "Loaded search tree with", root.visits, "visits"
+            return root
+        except ValueError:
+            pass
+    return mcts.TranspositionMCTSNode(cf.copy(), table=table)
 
 def playMCTSgame():
 
-    cf = connectfour.ConnectFourGameState()
-    root = mcts.MCTSNode(cf)
-    node = root
+    cf = connectfour.BitboardConnectFourGameState()
+    node = mcts.TranspositionMCTSNode(
+        cf.copy(), table=mcts.TranspositionTable(symmetric=True))
+    root = None
+    exactSolver = solver.ExactSolver(SOLVER_EMPTY_CELLS)
+    policy = policies.ConnectFourTacticalPolicy()
+    book = openBook()
 
     while cf.winner is None:
-        move = mcts.mcts(node, 20000)
+        move = None if book is None else book.lookup(cf)
+        if move is None:
+            if root is None:
+                node = root = loadSearchTree(cf)
+            stats = mcts.SearchStats()
+            move = mcts.mcts(node, 20000, solver=exactSolver, stats=stats,
+                             policy=policy)
+        else:
+            stats = "book move"
         cf.executeMove(move)
-        node = mcts.MCTSNode(cf)
+        node = node.reroot(move)
         print cf
         print "Move:", move
+        print "Search:", stats
 
     print "Winner is player", cf.winner
 
+    if root is not None:
+        print "Saved", treefile.saveTree(root, TREE_FILE), "nodes to", \
+            TREE_FILE
+
 def playAgainstMCTS():
-    cf = connectfour.ConnectFourGameState()
+    cf = connectfour.BitboardConnectFourGameState()
+    node = mcts.TranspositionMCTSNode(
+        cf.copy(), table=mcts.TranspositionTable(symmetric=True))
+    exactSolver = solver.ExactSolver(SOLVER_EMPTY_CELLS)
+    policy = policies.ConnectFourTacticalPolicy()
+    book = openBook()
     print cf
 
     while True:
 
         move = int(input("Make your move: "))
         cf.executeMove(move)
+        node = node.reroot(move)
 
         if cf.winner is not None:
             break
 
-        node = mcts.MCTSNode(cf)
-        computerMove = mcts.mcts(node, 10000)
+        computerMove = None if book is None else book.lookup(cf)
+        if computerMove is None:
+            computerMove = mcts.mcts(node, 10000, solver=exactSolver,
+                                     policy=policy)
         cf.executeMove(computerMove)
+        node = node.reroot(computerMove)
         print cf
 
         if cf.winner is not None:
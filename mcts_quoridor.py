@@ -1,27 +1,54 @@
+import os
 import time
 
 import mcts
+import openingbook
+import policies
 import quoridor
+import treefile
+
+# The search tree of the opening position is kept here between runs
+TREE_FILE = 'quoridor.tree'
+
+# Built with python openingbook.py quoridor
+BOOK_FILE = 'quoridor.book'
 
 def playMCTSgame():
 
     q = quoridor.QuoridorGameState()
-    root = mcts.MCTSNode(q)
+    if os.path.exists(TREE_FILE):
+        root = treefile.loadTree(TREE_FILE, q.copy(), mcts.StatelessMCTSNode)
+        print "Loaded search tree with", root.visits, "visits"
+    else:
+        root = mcts.StatelessMCTSNode(q.copy())
     node = root
+    policy = policies.QuoridorPathPolicy()
+    book = None
+    if os.path.exists(BOOK_FILE):
+        book = openingbook.OpeningBook(BOOK_FILE)
 
     while q.winner is None:
+        stats = None
         start = time.clock()
-        move = mcts.mcts(node, 10000)
+        move = None if book is None else book.lookup(q)
+        if move is None:
+            stats = mcts.SearchStats()
+            move = mcts.mcts(node, 10000, timeLimit=30.0, earlyStop=True,
+                             stats=stats, policy=policy)
         end = time.clock()
         print "Move time: " , str(end - start)
+        if stats is not None:
+            print "Search:", stats
         q.executeMove(move)
-        node = mcts.MCTSNode(q)
+        node = node.reroot(move)
 
-        print "Player", str(3 % q.currentPlayer), "Move:", move
+        print "Player", str(3 % q.currentPlayer), "Move:", quoridor.formatMove(move)
         print q
 
     print "Winner is player", q.winner
 
+    print "Saved", treefile.saveTree(root, TREE_FILE), "nodes to", TREE_FILE
+
 if __name__ == "__main__":
     playMCTSgame()
 
@@ -1,34 +1,39 @@
 __author__ = 'MQC1472'
 
 import mcts
+import solver
 import tictactoe
 
 def playMCTSgame():
 
     ttt = tictactoe.TicTacToeGameState()
-    root = mcts.MCTSNode(ttt)
+    root = mcts.TranspositionMCTSNode(ttt.copy())
     node = root
+    exactSolver = solver.ticTacToeSolver()
     while ttt.winner is None:
-        move = mcts.mcts(node, 10000)
+        move = mcts.mcts(node, 10000, solver=exactSolver)
         ttt.executeMove(move)
-        node = mcts.MCTSNode(ttt)
+        node = node.reroot(move)
         print ttt
 
 def playAgainstMCTS():
     ttt = tictactoe.TicTacToeGameState()
+    node = mcts.TranspositionMCTSNode(ttt.copy())
+    exactSolver = solver.ticTacToeSolver()
     print ttt
 
     while True:
 
         move = int(input("Make your move: "))
         ttt.executeMove(move)
+        node = node.reroot(move)
 
         if ttt.winner is not None:
             break
 
-        node = mcts.MCTSNode(ttt)
-        computerMove = mcts.mcts(node, 10000)
+        computerMove = mcts.mcts(node, 10000, solver=exactSolver)
         ttt.executeMove(computerMove)
+        node = node.reroot(computerMove)
         print ttt
 
         if ttt.winner is not None:
@@ -0,0 +1,235 @@
+"""
+Opening books: the move a deep search chose in each position of the first
+few plies of a game, computed offline and looked up by position hash.
+
+    python openingbook.py connectfour [--plies 2] [--iterations 50000]
+                                      [--workers 4] [--output FILE]
+
+Every position up to --plies moves from the start is searched for
+--iterations iterations, in parallel worker processes, and the results
+are written to a book file of fixed size little-endian records sorted by
+position hash:
+
+    header  magic, version, number of entries
+    entries hash, move, visits, value of the move   (28 bytes)
+
+OpeningBook memory-maps the file and finds a position with a binary
+search. The drivers consult it before searching.
+"""
+
+from collections import OrderedDict
+import argparse
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+
+import connectfour
+import mcts
+import policies
+import quoridor
+
+MAGIC = 'MCTSBOOK'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIQ')
+_ENTRY = struct.Struct('<Qiqd')
+
+# Per game: the start position, the tree node class and rollout policy of
+# the searches, and the default book file. The game states are those the
+# drivers play with, as the hashes of the two Connect Four states differ.
+GAMES = OrderedDict([
+    ('connectfour', {
+        'newGame': connectfour.BitboardConnectFourGameState,
+        'nodeClass': mcts.TranspositionMCTSNode,
+        'policy': policies.ConnectFourTacticalPolicy(),
+        'output': 'connectfour.book',
+    }),
+    ('quoridor', {
+        'newGame': quoridor.QuoridorGameState,
+        'nodeClass': mcts.StatelessMCTSNode,
+        'policy': policies.QuoridorPathPolicy(),
+        'output': 'quoridor.book',
+    }),
+])
+
+
+class OpeningBook(object):
+    """
+    Read access to a memory-mapped book file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.numEntries = _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d opening book" %
+                             (path, VERSION))
+
+    def __len__(self):
+        return self.numEntries
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self.map,
+                                  _HEADER.size + index * _ENTRY.size)
+
+    def entry(self, gamestate):
+        """
+        Returns the (move, visits, value) the book holds for the position,
+        or None if it is not in the book.
+        """
+
+        low, high = 0, self.numEntries
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < gamestate.hash:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self.numEntries:
+            return None
+        positionHash, move, visits, value = self._entry(low)
+        if positionHash != gamestate.hash:
+            return None
+        return move, visits, int(value) if value.is_integer() else value
+
+    def lookup(self, gamestate):
+        """
+        Returns the book move for the position, or None if there is none.
+        A move that is not legal in the position, which would take a hash
+        collision, is ignored.
+        """
+
+        entry = self.entry(gamestate)
+        if entry is None or entry[0] not in gamestate.getLegalMoves():
+            return None
+        return entry[0]
+
+
+def expandPositions(gamestate, plies):
+    """
+    Returns every position reachable from the gamestate in at most the
+    given number of moves, once each and with the game not over, in order
+    of increasing depth.
+    """
+
+    positions = [gamestate]
+    seen = set([gamestate.hash])
+    frontier = [gamestate]
+    for _ in xrange(plies):
+        nextFrontier = []
+        for position in frontier:
+            for move in position.getLegalMoves():
+                child = position.copy()
+                child.executeMove(move)
+                if child.winner is None and child.hash not in seen:
+                    seen.add(child.hash)
+                    nextFrontier.append(child)
+        positions.extend(nextFrontier)
+        frontier = nextFrontier
+
+    return positions
+
+
+def _searchPosition(args):
+    gamestate, iterations, seed, nodeClass, policy = args
+
+    # Forked workers inherit the parent's random state, see rootParallelMCTS
+    random.seed(seed)
+
+    root = nodeClass(gamestate)
+    mcts.search(root, iterations, policy=policy)
+    move = root.selectBestMove()
+    child = root.children[move]
+
+    return gamestate.hash, move, child.visits, child.value
+
+
+def buildBook(gamestate, plies, iterations, numWorkers=None, pool=None,
+              nodeClass=mcts.MCTSNode, policy=None, progress=None):
+    """
+    Searches every position up to plies moves from the gamestate in a
+    process pool, one position per task, and returns the book entries as
+    (hash, move, visits, value) tuples. The pool and number of workers mean
+    the same as for mcts.rootParallelMCTS. With progress, progress(done,
+    total) is called each time a position has been searched.
+    """
+
+    positions = expandPositions(gamestate, plies)
+    jobs = [(position, iterations, random.getrandbits(32), nodeClass, policy)
+            for position in positions]
+
+    ownPool = pool is None
+    if ownPool:
+        pool = multiprocessing.Pool(numWorkers)
+
+    entries = []
+    try:
+        for entry in pool.imap_unordered(_searchPosition, jobs):
+            entries.append(entry)
+            if progress is not None:
+                progress(len(entries), len(jobs))
+    finally:
+        if ownPool:
+            pool.close()
+            pool.join()
+
+    return entries
+
+
+def writeBook(entries, path):
+    """
+    Writes the (hash, move, visits, value) entries to path as a book file,
+    replacing it once it has been written completely.
+    """
+
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(entries)))
+        for entry in sorted(entries):
+            f.write(_ENTRY.pack(*entry))
+
+    os.rename(temporaryPath, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build an opening book.')
+    parser.add_argument('game', choices=GAMES.keys())
+    parser.add_argument('--plies', type=int, default=2,
+                        help='moves from the start to cover (default 2)')
+    parser.add_argument('--iterations', type=int, default=50000,
+                        help='search iterations per position')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default one per core)')
+    parser.add_argument('--output', help='book file to write')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    game = GAMES[args.game]
+    random.seed(args.seed)
+
+    start = time.time()
+
+    def progress(done, total):
+        if done % 10 == 0 or done == total:
+            print "%d/%d positions, %.0f seconds" % (
+                done, total, time.time() - start)
+
+    entries = buildBook(game['newGame'](), args.plies, args.iterations,
+                        args.workers, nodeClass=game['nodeClass'],
+                        policy=game['policy'], progress=progress)
+
+    output = args.output or game['output']
+    writeBook(entries, output)
+    print "Wrote %d positions to %s" % (len(entries), output)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
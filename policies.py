@@ -0,0 +1,141 @@
+"""
+Rollout policies that play better than uniformly random moves, for the
+policy argument of mcts.search (see mcts.RolloutPolicy). Informed rollouts
+end sooner and their results say more about the position they start from.
+"""
+
+import math
+import random
+import time
+
+import connectfour
+import mcts
+import quoridor
+
+# The lead in pawn moves at which quoridorPathEvaluation gives a player
+# about three chances in four of winning (tanh(1) is 0.76)
+QUORIDOR_EVALUATION_SCALE = 4.0
+
+
+def quoridorPathEvaluation(gamestate, player):
+    """
+    Scores a Quoridor position for player as a race to the goal rows: how
+    many pawn moves the player is ahead of the opponent, counting half a
+    move for having the turn, squashed into (-1, 1). Walls still to be
+    placed are not taken into account.
+    """
+
+    lead = gamestate.distanceToGoal(3 - player) - \
+        gamestate.distanceToGoal(player)
+    lead += 0.5 if gamestate.currentPlayer == player else -0.5
+    return math.tanh(lead / QUORIDOR_EVALUATION_SCALE)
+
+
+class QuoridorPathPolicy(mcts.RolloutPolicy):
+    """
+    Steps the pawn along its shortest path with probability stepProbability
+    and otherwise plays a uniformly random legal move, which may be a wall.
+    By default rollouts are cut off after maxMoves moves and scored with
+    quoridorPathEvaluation.
+    """
+
+    def __init__(self, stepProbability=0.7, maxMoves=60,
+                 evaluate=quoridorPathEvaluation):
+        super(QuoridorPathPolicy, self).__init__(maxMoves, evaluate)
+        self.stepProbability = stepProbability
+
+    def selectMove(self, gamestate):
+        if random.random() < self.stepProbability:
+            return gamestate.getShortestPathMove()
+        return gamestate.sampleRandomLegalMove()
+
+
+class ConnectFourTacticalPolicy(mcts.RolloutPolicy):
+    """
+    Plays an immediate win if there is one, otherwise blocks a column
+    where the opponent would win on their next move, otherwise plays a
+    random column. Needs a BitboardConnectFourGameState.
+    """
+
+    def selectMove(self, gamestate):
+        winningMoves = gamestate.getWinningMoves(gamestate.currentPlayer)
+        if winningMoves:
+            return winningMoves[0]
+
+        threats = gamestate.getWinningMoves(3 - gamestate.currentPlayer)
+        if threats:
+            return random.choice(threats)
+
+        return random.choice(gamestate.getLegalMoves())
+
+
+def compareRollouts(gamestate, policies, rollouts):
+    """
+    Plays rollouts from the position with each of the named policies and
+    prints the rollouts per second and their mean length.
+    """
+
+    print "%-10s %12s %10s" % ('policy', 'rollouts/s', 'length')
+    for name, policy in policies:
+        stats = mcts.SearchStats(timeMoveSelection=False)
+        start = time.clock()
+        for _ in xrange(rollouts):
+            mcts.rollout(gamestate.copy(), stats, policy)
+        elapsed = time.clock() - start
+        print "%-10s %12.1f %10.1f" % (
+            name, rollouts / elapsed,
+            float(stats.rolloutMoves) / stats.rollouts)
+
+
+def playMatch(newGame, nodeClass, policies, iterations, games):
+    """
+    Plays games between two searches of the same number of iterations that
+    differ only in their rollout policy, alternating who moves first, and
+    prints the score of each. policies is a pair of (name, policy).
+    """
+
+    wins = [0, 0]
+    draws = 0
+    for game in xrange(games):
+        gamestate = newGame()
+        # Searcher first moves as player 1 in even games
+        first = game % 2
+        while gamestate.winner is None:
+            searcher = first if gamestate.currentPlayer == 1 else 1 - first
+            root = nodeClass(gamestate.copy())
+            move = mcts.mcts(root, iterations,
+                             policy=policies[searcher][1])
+            gamestate.executeMove(move)
+
+        if gamestate.winner == 0:
+            draws += 1
+        else:
+            wins[first if gamestate.winner == 1 else 1 - first] += 1
+
+    print "%s %d, %s %d, draws %d at %d iterations per move" % (
+        policies[0][0], wins[0], policies[1][0], wins[1], draws, iterations)
+
+
+def main():
+    random.seed(0)
+
+    print "Connect Four, opening"
+    compareRollouts(connectfour.BitboardConnectFourGameState(),
+                    [('random', None),
+                     ('tactical', ConnectFourTacticalPolicy())], 5000)
+    playMatch(connectfour.BitboardConnectFourGameState, mcts.MCTSNode,
+              [('random', None), ('tactical', ConnectFourTacticalPolicy())],
+              1000, 20)
+    print
+
+    print "Quoridor, opening"
+    compareRollouts(quoridor.QuoridorGameState(),
+                    [('random', None),
+                     ('path', QuoridorPathPolicy(maxMoves=None)),
+                     ('cutoff', QuoridorPathPolicy())], 200)
+    playMatch(quoridor.QuoridorGameState, mcts.StatelessMCTSNode,
+              [('random', None), ('cutoff', QuoridorPathPolicy())],
+              200, 4)
+
+if __name__ == '__main__':
+    main()
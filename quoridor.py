@@ -1,4 +1,6 @@
-from collections import deque, OrderedDict
+from bisect import insort
+from collections import OrderedDict
+import random
 import graph_algorithms
 
 __author__ = 'Markus'
@@ -11,8 +13,94 @@ class WallType():
     VERTICAL = 8
 
 
+class MoveType():
+    """
+    A move is a single integer, position << 2 | type, where the position is
+    the destination cell of a pawn move or the vertex of a wall. With these
+    type values, move >> 1 of a wall move is its wall slot (see
+    _createWallConflictGraph).
+    """
+    PAWN = 0
+    VERTICAL = 1
+    HORIZONTAL = 2
+
+
+def parseMove(move):
+    """
+    Converts a move from its string form, 'hP' or 'vP' for a horizontal or
+    vertical wall at vertex P and the destination cell for a pawn move, to
+    its integer form.
+    """
+
+    if move[0] == 'h':
+        return int(move[1:]) << 2 | MoveType.HORIZONTAL
+    elif move[0] == 'v':
+        return int(move[1:]) << 2 | MoveType.VERTICAL
+    else:
+        return int(move) << 2 | MoveType.PAWN
+
+
+def formatMove(move):
+    """
+    Converts a move from its integer form to its string form.
+    """
+
+    position = move >> 2
+    if move & 3 == MoveType.HORIZONTAL:
+        return 'h' + str(position)
+    elif move & 3 == MoveType.VERTICAL:
+        return 'v' + str(position)
+    else:
+        return str(position)
+
+
+class ZobristKeys(object):
+    """
+    Random keys for Zobrist hashing a Quoridor position: one per pawn and
+    cell, per wall orientation and vertex, per player and number of walls
+    left, and one for player 2 being to move. Keys are generated from a
+    fixed seed so a position hashes the same in every process.
+    """
+
+    _tables = {}
+
+    def __init__(self, numCells, numVertexes, maxWalls):
+        rng = random.Random(numCells)
+        self.pawns = [[rng.getrandbits(64) for _ in xrange(numCells)]
+                      for _ in xrange(2)]
+        self.walls = {}
+        self.walls[MoveType.HORIZONTAL] = [rng.getrandbits(64)
+                                           for _ in xrange(numVertexes)]
+        self.walls[MoveType.VERTICAL] = [rng.getrandbits(64)
+                                         for _ in xrange(numVertexes)]
+        self.wallsLeft = [[rng.getrandbits(64) for _ in xrange(maxWalls + 1)]
+                          for _ in xrange(2)]
+        self.player2ToMove = rng.getrandbits(64)
+
+    @classmethod
+    def forBoard(cls, numCells, numVertexes, maxWalls):
+        key = (numCells, numVertexes, maxWalls)
+        if key not in cls._tables:
+            cls._tables[key] = cls(numCells, numVertexes, maxWalls)
+        return cls._tables[key]
+
+
 class QuoridorGameState(object):
 
+    # Static board tables by board size, see _createStaticTables
+    _staticTables = {}
+
+    WALLS_PER_PLAYER = 10
+
+    # Decides whether a player can still reach their goal, called as
+    # canReachGoal(gamestate, player) while a wall is tried out. To use the
+    # heap search instead of the bitmask flood fill, set it on an instance
+    # to graph_algorithms.greedyBestFirst, or on the class to
+    # staticmethod(graph_algorithms.greedyBestFirst); a plain function set
+    # on the class would be bound to the game state and called with it
+    # twice.
+    canReachGoal = staticmethod(graph_algorithms.floodFillReachable)
+
     def __init__(self):
 
         # A board will be size x size cells square. Must be odd.
@@ -28,51 +116,28 @@ class QuoridorGameState(object):
         # The number of vertices in on the board
         self.numVertexes = self.vertexSize ** 2
 
-        # Walls will be stored at the vertices. Horizontal and vertical edges
-        # are kept separately to simplify the representation
-        self.walls = [WallType.EMPTY] * self.numVertexes
-
-        # Add walls to the rim of the board. This is useful to simplify finding
-        # legal moves. Moving off the edge is no longer a corner case.
-        self.walls[:self.vertexSize] = [WallType.HORIZONTAL] * self.vertexSize
-        self.walls[-self.vertexSize:] = [WallType.HORIZONTAL] * self.vertexSize
-
-        for i in xrange(self.vertexSize, self.numVertexes - self.vertexSize,
-                            self.vertexSize):
-            self.walls[i] = WallType.VERTICAL
-            self.walls[i + self.boardSize] = WallType.VERTICAL
-
-        # A list of only the non-rim wall locations, for convenience
-        self.nonRimWalls = []
-        for v in xrange(self.numVertexes):
-            row = v / self.vertexSize
-            col = v % self.vertexSize
-            if row > 0 and col > 0 and row < self.vertexSize - 1 \
-                and col < self.vertexSize - 1:
-                self.nonRimWalls.append(v)
-
-        # The movement map
-        self.distance = OrderedDict([
-            ('N', -self.boardSize),
-            ('S', self.boardSize),
-            ('E', 1),
-            ('W', -1),
-        ])
-
-        # Static relationships about the board
-        # TODO: These should be static variables and should not be recreated
-        # for each instance of the board if using a fixed board size
-        self._createCellVertexGraph()
-        # TODO:  self._createVertexVertexGraph()
-        self._createVertexCellGraph()
-        self._createEdgeWallGraph()
-
         # Special goal cells that are used to simplify graph traversals
         self.PLAYER1_GOAL = self.numCells
         self.PLAYER2_GOAL = self.numCells + 1
 
-        # Dynamic relationship about the board
-        self._createCellGraph()
+        # Static relationships about the board. They only depend on the board
+        # size, so they are built once and shared by every instance.
+        tables = self._staticTables.get(self.boardSize)
+        if tables is None:
+            tables = self._createStaticTables()
+            self._staticTables[self.boardSize] = tables
+        self.__dict__.update(tables)
+
+        # Dynamic relationships about the board, starting from the empty
+        # board of the static tables
+        self.walls = list(self.emptyWalls)
+        self.cellGraph = [list(n) for n in self.emptyCellGraph]
+
+        # The same edges as bitmasks over the cells: bit c of openEast is set
+        # while c and c + 1 are connected, and bit c of openSouth while c and
+        # c + boardSize are, see graph_algorithms.floodFillReachable
+        self.openEast = self.emptyOpenEast
+        self.openSouth = self.emptyOpenSouth
 
         # Starting positions and starting number of walls to place
         # Player 1 starts at center bottom, player 2 at center top
@@ -80,26 +145,81 @@ class QuoridorGameState(object):
         player2Start = self.boardSize / 2
         self.playerPositions = [player1Start, player2Start]
 
-        self.numPlayerWalls = [10, 10]
+        self.numPlayerWalls = [self.WALLS_PER_PLAYER] * 2
+
+        # Wall slots that are geometrically free: no placed wall overlaps or
+        # crosses them. Bit s of placeableWalls is set while wallBlockers[s]
+        # is zero; see _createWallConflictGraph for the slot numbering.
+        self.wallBlockers = [0] * (2 * self.numVertexes)
+        self.placeableWalls = 0
+        for v in self.nonRimWalls:
+            self.placeableWalls |= 3 << 2 * v
+
+        # A cached shortest path to goal for each player, as the set of
+        # cell-cell edges it uses. A wall that cuts none of these edges
+        # cannot block anyone. None means the path must be recomputed.
+        self.shortestPaths = [None, None]
+        self.shortestPathEdges = [None, None]
+
+        # For undoMove: each move made on this state, with what is needed to
+        # take it back. Only recorded while trackUndo is set, as rollouts
+        # never take moves back. A copy starts with an empty stack and
+        # without tracking.
+        self.trackUndo = False
+        self.moveStack = []
 
         self.currentPlayer = 1
         self.winner = None
 
+        # Incremental Zobrist hash of the position. Wall owners are not part
+        # of it, as they do not affect the game.
+        self.hash = self.zobrist.pawns[0][player1Start] ^ \
+            self.zobrist.pawns[1][player2Start] ^ \
+            self.zobrist.wallsLeft[0][self.numPlayerWalls[0]] ^ \
+            self.zobrist.wallsLeft[1][self.numPlayerWalls[1]]
+
     def copy(self):
-        q = QuoridorGameState()
+        # Start from a shallow copy, which shares the static tables and the
+        # immutable values, then duplicate the mutable dynamic state
+        q = QuoridorGameState.__new__(QuoridorGameState)
+        q.__dict__.update(self.__dict__)
+
         q.walls = list(self.walls)
+        q.cellGraph = [list(n) for n in self.cellGraph]
         q.playerPositions = list(self.playerPositions)
         q.numPlayerWalls = list(self.numPlayerWalls)
-        q.currentPlayer = self.currentPlayer
-        q.winner = self.winner
+        q.wallBlockers = list(self.wallBlockers)
+        q.shortestPaths = list(self.shortestPaths)
+        q.shortestPathEdges = list(self.shortestPathEdges)
+        q.trackUndo = False
+        q.moveStack = []
 
         return q
 
+    def __getstate__(self):
+        # Pickle only the dynamic state; the static tables are rebuilt or
+        # looked up on the receiving side
+        tables = self._staticTables[self.boardSize]
+        return dict((k, v) for k, v in self.__dict__.iteritems()
+                    if k not in tables)
+
+    def __setstate__(self, state):
+        # Building the tables overwrites the dynamic board, so restore the
+        # pickled state last
+        self.boardSize = state['boardSize']
+        tables = self._staticTables.get(self.boardSize)
+        if tables is None:
+            self.__dict__.update(state)
+            tables = self._createStaticTables()
+            self._staticTables[self.boardSize] = tables
+        self.__dict__.update(tables)
+        self.__dict__.update(state)
+
     def getLegalMoves(self):
-        # Moves can be:
-        # Place horizontal wall at position P 'hP'
-        # Place vertical wall at position P 'vP'
-        # Move player in any of the 4 cardinal directions 'N', 'S', 'E', 'W'
+        # Moves can be (see MoveType):
+        # Place horizontal wall at position P, P << 2 | HORIZONTAL ('hP')
+        # Place vertical wall at position P, P << 2 | VERTICAL ('vP')
+        # Move player to a neighboring cell C, C << 2 | PAWN ('C')
 
         wallMoves = self._getValidWallMoves()
         # Determine pawn moves
@@ -109,7 +229,100 @@ class QuoridorGameState(object):
         # TODO: Add the logic for jumping over players
         # Currently, players will be able to occupy the same spot
 
-        return wallMoves + map(str, pawnMoves)
+        return wallMoves + [c << 2 for c in pawnMoves]
+
+    def getMoveCandidates(self):
+        """
+        Returns the pawn moves and every geometrically free wall, a superset
+        of the legal moves that is cheap to build. isLegalCandidate then
+        tells which of them are legal, so that callers needing only some of
+        the moves can skip the blocking checks for the rest.
+        """
+
+        candidates = [c << 2 for c in self._getValidPawnMoves(
+            self.playerPositions[self.currentPlayer - 1])]
+
+        if self.numPlayerWalls[self.currentPlayer - 1] > 0:
+            slots = self.placeableWalls
+            while slots:
+                lowestBit = slots & -slots
+                slots ^= lowestBit
+                candidates.append(
+                    self.wallSlotMoves[lowestBit.bit_length() - 1])
+
+        return candidates
+
+    def isLegalCandidate(self, move):
+        # Pawn moves and free walls only need the blocking check
+        return not move & 3 or not self._doesWallBlockVictory(move)
+
+    def sampleRandomLegalMove(self):
+        """
+        Returns a legal move chosen uniformly at random, like
+        random.choice(self.getLegalMoves()) but without checking every wall.
+        A pawn move or a wall slot anywhere on the board is drawn at random
+        and only that wall is checked; occupied or blocking walls are drawn
+        again. Every legal move is equally likely to be the first one
+        accepted.
+        """
+
+        pawnMoves = self._getValidPawnMoves(
+            self.playerPositions[self.currentPlayer - 1])
+
+        if self.numPlayerWalls[self.currentPlayer - 1] == 0:
+            return random.choice(pawnMoves) << 2
+
+        # A pawn always has a legal move, so this ends
+        numPawnMoves = len(pawnMoves)
+        numMoves = numPawnMoves + len(self.boardWallMoves)
+        while True:
+            i = random.randrange(numMoves)
+            if i < numPawnMoves:
+                return pawnMoves[i] << 2
+
+            move = self.boardWallMoves[i - numPawnMoves]
+            if self.placeableWalls >> (move >> 1) & 1 and \
+                    not self._doesWallBlockVictory(move):
+                return move
+
+    def getShortestPathMove(self):
+        """
+        Returns the pawn move taking the current player one step along a
+        shortest path to their goal.
+        """
+
+        player = self.currentPlayer - 1
+        self._getShortestPathEdges(player)
+        return self.shortestPaths[player][1] << 2
+
+    def distanceToGoal(self, player):
+        """
+        Returns the number of pawn moves player (1 or 2, as currentPlayer)
+        needs to reach their goal row if no more walls are placed.
+        """
+
+        self._getShortestPathEdges(player - 1)
+        return len(self.shortestPaths[player - 1]) - 1
+
+    def getDecidedWinner(self):
+        """
+        Returns the player who wins with best play if that is already
+        settled, and None otherwise. Once neither player has a wall left
+        the game is a race: pawns do not block each other, so each player
+        just walks a shortest path, and the player to move wins unless
+        they are further from their goal than the opponent.
+        """
+
+        if self.winner is not None:
+            return self.winner
+
+        if self.numPlayerWalls[0] or self.numPlayerWalls[1]:
+            return None
+
+        if self.distanceToGoal(self.currentPlayer) <= \
+                self.distanceToGoal(3 - self.currentPlayer):
+            return self.currentPlayer
+        return 3 - self.currentPlayer
 
     def executeMove(self, move):
 
@@ -119,13 +332,50 @@ class QuoridorGameState(object):
 
         assert self.winner is None
 
-        if move[0] == 'h' or move[0] == 'v':
+        player = self.currentPlayer - 1
+        if self.trackUndo:
+            self.moveStack.append((move, self.playerPositions[player],
+                                   tuple(self.shortestPaths),
+                                   tuple(self.shortestPathEdges)))
+
+        if move & 3:
             self._doWallMove(move)
         else:
-            self.playerPositions[self.currentPlayer - 1] = int(move)
+            position = move >> 2
+            self.hash ^= self.zobrist.pawns[player][
+                self.playerPositions[player]] ^ \
+                self.zobrist.pawns[player][position]
+            self.playerPositions[player] = position
+            self._advanceShortestPath(player, position)
 
         self.checkForWin()
         self.currentPlayer = 3 - self.currentPlayer
+        self.hash ^= self.zobrist.player2ToMove
+
+    def undoMove(self):
+        """
+        Takes back the last move made on this state, restoring the position
+        exactly, cached shortest paths included. Only moves made while
+        trackUndo was set can be taken back.
+        """
+
+        move, position, paths, pathEdges = self.moveStack.pop()
+
+        self.currentPlayer = 3 - self.currentPlayer
+        self.hash ^= self.zobrist.player2ToMove
+        self.winner = None
+
+        if move & 3:
+            self._undoWallMove(move)
+        else:
+            player = self.currentPlayer - 1
+            self.hash ^= self.zobrist.pawns[player][
+                self.playerPositions[player]] ^ \
+                self.zobrist.pawns[player][position]
+            self.playerPositions[player] = position
+
+        self.shortestPaths = list(paths)
+        self.shortestPathEdges = list(pathEdges)
 
     def checkForWin(self):
         p1, p2 = self.playerPositions[0], self.playerPositions[1]
@@ -136,61 +386,186 @@ class QuoridorGameState(object):
 
     def _doWallMove(self, move):
 
-        position = int(move[1:])
+        self._placeWall(move)
+
+        slot = move >> 1
+        for conflict in self.wallConflicts[slot]:
+            self.wallBlockers[conflict] += 1
+            if self.wallBlockers[conflict] == 1:
+                self.placeableWalls &= ~(1 << conflict)
+
+        # Forget any cached path the wall cuts through
+        for player in [0, 1]:
+            pathEdges = self.shortestPathEdges[player]
+            if pathEdges is not None and \
+                    not pathEdges.isdisjoint(self.wallEdges[slot]):
+                self.shortestPaths[player] = None
+                self.shortestPathEdges[player] = None
+
+    def _undoWallMove(self, move):
+
+        self._removeWall(move)
+
+        for slot in self.wallConflicts[move >> 1]:
+            self.wallBlockers[slot] -= 1
+            if self.wallBlockers[slot] == 0:
+                self.placeableWalls |= 1 << slot
+
+    def _getShortestPathEdges(self, player):
+        if self.shortestPathEdges[player] is None:
+            path = graph_algorithms.shortestPath(self, player)
+            self._setShortestPath(player, path)
+
+        return self.shortestPathEdges[player]
 
-        self.numPlayerWalls[self.currentPlayer - 1] -= 1
+    def _setShortestPath(self, player, path):
+        self.shortestPaths[player] = path
+        self.shortestPathEdges[player] = set(
+            (min(u, v), max(u, v)) for u, v in zip(path, path[1:]))
 
-        cellNeighbors = self.vertexCellGraph[position]
-        cellNeighbors.sort()
+    def _advanceShortestPath(self, player, position):
+        # A pawn stepping along its cached path keeps the rest of it, which
+        # is still a shortest path. Any other step invalidates the cache.
+        path = self.shortestPaths[player]
+        if path is not None and position in path:
+            self._setShortestPath(player, path[path.index(position):])
+        else:
+            self.shortestPaths[player] = None
+            self.shortestPathEdges[player] = None
+
+    def _placeWall(self, move):
+        # Places the wall on the board without updating the free wall slots,
+        # which is all that is needed to try a wall out
+
+        position = move >> 2
 
-        assert len(cellNeighbors) == 4
-        NW, NE, SW, SE = cellNeighbors
+        player = self.currentPlayer - 1
+        self.hash ^= self.zobrist.walls[move & 3][position] ^ \
+            self.zobrist.wallsLeft[player][self.numPlayerWalls[player]] ^ \
+            self.zobrist.wallsLeft[player][self.numPlayerWalls[player] - 1]
+        self.numPlayerWalls[player] -= 1
 
-        if move[0] == 'h':
+        NW, NE, SW, SE = self.vertexCellGraph[position]
+
+        if move & 3 == MoveType.HORIZONTAL:
             # Update the wall list and reduce the walls for that player
             self.walls[position] = self.currentPlayer + WallType.HORIZONTAL
+            self.openSouth &= ~self.wallCutBits[move >> 1]
 
             self.cellGraph[NW].remove(SW)
             self.cellGraph[SW].remove(NW)
             self.cellGraph[NE].remove(SE)
             self.cellGraph[SE].remove(NE)
 
-        elif move[0] == 'v':
+        elif move & 3 == MoveType.VERTICAL:
             # Update the wall list and reduce the walls for that player
             self.walls[position] = self.currentPlayer + WallType.VERTICAL
+            self.openEast &= ~self.wallCutBits[move >> 1]
 
             self.cellGraph[NW].remove(NE)
             self.cellGraph[NE].remove(NW)
             self.cellGraph[SW].remove(SE)
             self.cellGraph[SE].remove(SW)
 
-    def _undoWallMove(self, move):
+    def _removeWall(self, move):
 
-        position = int(move[1:])
+        position = move >> 2
 
-        self.numPlayerWalls[self.currentPlayer - 1] += 1
+        player = self.currentPlayer - 1
+        self.hash ^= self.zobrist.walls[move & 3][position] ^ \
+            self.zobrist.wallsLeft[player][self.numPlayerWalls[player]] ^ \
+            self.zobrist.wallsLeft[player][self.numPlayerWalls[player] + 1]
+        self.numPlayerWalls[player] += 1
 
-        cellNeighbors = self.vertexCellGraph[position]
-        cellNeighbors.sort()
-
-        assert len(cellNeighbors) == 4
-        NW, NE, SW, SE = cellNeighbors
+        NW, NE, SW, SE = self.vertexCellGraph[position]
 
         self.walls[position] = WallType.EMPTY
 
-        if move[0] == 'h':
+        # Neighbor lists are kept sorted, so taking a wall back restores the
+        # graph exactly and path searches over it do not depend on which
+        # walls were tried out before
+        if move & 3 == MoveType.HORIZONTAL:
+            self.openSouth |= self.wallCutBits[move >> 1]
+
+            insort(self.cellGraph[NW], SW)
+            insort(self.cellGraph[SW], NW)
+            insort(self.cellGraph[NE], SE)
+            insort(self.cellGraph[SE], NE)
+
+        elif move & 3 == MoveType.VERTICAL:
+            self.openEast |= self.wallCutBits[move >> 1]
+
+            insort(self.cellGraph[NW], NE)
+            insort(self.cellGraph[NE], NW)
+            insort(self.cellGraph[SW], SE)
+            insort(self.cellGraph[SE], SW)
+
+    def _createStaticTables(self):
+        """
+        Builds the tables that only depend on the board size and returns
+        them as a dictionary of attribute names to values.
+        """
+
+        # Walls will be stored at the vertices. Horizontal and vertical edges
+        # are kept separately to simplify the representation
+        self.walls = [WallType.EMPTY] * self.numVertexes
+
+        # Add walls to the rim of the board. This is useful to simplify finding
+        # legal moves. Moving off the edge is no longer a corner case.
+        self.walls[:self.vertexSize] = [WallType.HORIZONTAL] * self.vertexSize
+        self.walls[-self.vertexSize:] = [WallType.HORIZONTAL] * self.vertexSize
+
+        for i in xrange(self.vertexSize, self.numVertexes - self.vertexSize,
+                            self.vertexSize):
+            self.walls[i] = WallType.VERTICAL
+            self.walls[i + self.boardSize] = WallType.VERTICAL
 
-            self.cellGraph[NW].append(SW)
-            self.cellGraph[SW].append(NW)
-            self.cellGraph[NE].append(SE)
-            self.cellGraph[SE].append(NE)
+        # A list of only the non-rim wall locations, for convenience
+        self.nonRimWalls = []
+        for v in xrange(self.numVertexes):
+            row = v / self.vertexSize
+            col = v % self.vertexSize
+            if row > 0 and col > 0 and row < self.vertexSize - 1 \
+                and col < self.vertexSize - 1:
+                self.nonRimWalls.append(v)
 
-        elif move[0] == 'v':
+        # The movement map
+        self.distance = OrderedDict([
+            ('N', -self.boardSize),
+            ('S', self.boardSize),
+            ('E', 1),
+            ('W', -1),
+        ])
 
-            self.cellGraph[NW].append(NE)
-            self.cellGraph[NE].append(NW)
-            self.cellGraph[SW].append(SE)
-            self.cellGraph[SE].append(SW)
+        self._createCellVertexGraph()
+        # TODO:  self._createVertexVertexGraph()
+        self._createVertexCellGraph()
+        self._createEdgeWallGraph()
+        self._createWallConflictGraph()
+        self._createCellGraph()
+        self._createEdgeMasks()
+
+        self.zobrist = ZobristKeys.forBoard(self.numCells, self.numVertexes,
+                                            self.WALLS_PER_PLAYER)
+
+        return {
+            'emptyWalls': self.walls,
+            'emptyCellGraph': self.cellGraph,
+            'nonRimWalls': self.nonRimWalls,
+            'distance': self.distance,
+            'cellVertexGraph': self.cellVertexGraph,
+            'vertexCellGraph': self.vertexCellGraph,
+            'edgeWallGraph': self.edgeWallGraph,
+            'wallSlotMoves': self.wallSlotMoves,
+            'boardWallMoves': self.boardWallMoves,
+            'wallConflicts': self.wallConflicts,
+            'wallEdges': self.wallEdges,
+            'wallCutBits': self.wallCutBits,
+            'emptyOpenEast': self.emptyOpenEast,
+            'emptyOpenSouth': self.emptyOpenSouth,
+            'goalRows': self.goalRows,
+            'zobrist': self.zobrist,
+        }
 
     def _createCellGraph(self):
         self.cellGraph = []
@@ -221,31 +596,36 @@ class QuoridorGameState(object):
         self.cellGraph.append([])
         self.cellGraph.append([])
 
+    def _createEdgeMasks(self):
+        # Bit c of the east (south) mask is set if cell c has an eastern
+        # (southern) neighbor on the empty board
+        self.emptyOpenEast = 0
+        self.emptyOpenSouth = 0
+        for cell in xrange(self.numCells):
+            if cell % self.boardSize != self.boardSize - 1:
+                self.emptyOpenEast |= 1 << cell
+            if cell < self.numCells - self.boardSize:
+                self.emptyOpenSouth |= 1 << cell
+
+        # The cells of the goal row of each player
+        topRow = (1 << self.boardSize) - 1
+        self.goalRows = [topRow,
+                         topRow << self.numCells - self.boardSize]
+
     def _getValidWallMoves(self):
-        # Determine wall moves if the current player has walls to place
+        # Determine wall moves if the current player has walls to place.
+        # Only the geometrically free slots are considered; of those, the
+        # walls that would cut a player off from their goal are dropped.
         wallMoves = []
         if self.numPlayerWalls[self.currentPlayer - 1] > 0:
-            for v in self.nonRimWalls:
-                # There will always be N, S, E, W neighbors since we are only
-                # sampling the non-rim walls in the board
-                # TODO: This should be replaced with a look-up table for speed
-                N, S, E, W = self._getVertexVertexNeighbors(v)
-
-                # I can place a vertical wall here if it is empty and there are
-                # no vertical walls above or below me
-                if not self.walls[N] & WallType.VERTICAL and \
-                    not self.walls[S] & WallType.VERTICAL and \
-                        self.walls[v] == WallType.EMPTY and \
-                        not self._doesWallBlockVictory(v, WallType.VERTICAL):
-                    wallMoves.append('v' + str(v))
-
-                # I can place a horizontal wall here if it is empty and there
-                # are no horizontal walls to the left or right of me
-                if not self.walls[E] & WallType.HORIZONTAL and \
-                    not self.walls[W] & WallType.HORIZONTAL and \
-                        self.walls[v] == WallType.EMPTY and \
-                        not self._doesWallBlockVictory(v, WallType.HORIZONTAL):
-                    wallMoves.append('h' + str(v))
+            slots = self.placeableWalls
+            while slots:
+                lowestBit = slots & -slots
+                slots ^= lowestBit
+                move = self.wallSlotMoves[lowestBit.bit_length() - 1]
+
+                if not self._doesWallBlockVictory(move):
+                    wallMoves.append(move)
 
         return wallMoves
 
@@ -259,24 +639,32 @@ class QuoridorGameState(object):
     def _inSameRow(self, cell1, cell2):
         return cell1 / self.boardSize == cell2 / self.boardSize
 
-    def _doesWallBlockVictory(self, wall, wallType):
+    def _doesWallBlockVictory(self, move):
 
-        blocksVictory = False
+        # Only a player whose cached shortest path the wall cuts could be
+        # blocked by it; everyone else can still follow their path
+        cutEdges = self.wallEdges[move >> 1]
+        playersCut = [player for player in [0, 1]
+                      if not self._getShortestPathEdges(player).isdisjoint(
+                          cutEdges)]
 
-        wallChar = 'h' if wallType == WallType.HORIZONTAL else 'v'
+        if not playersCut:
+            return False
+
+        blocksVictory = False
 
-        self._doWallMove(wallChar + str(wall))
+        self._placeWall(move)
 
-        if not self._doesWallTouchAnotherWall(wall):
+        if not self._doesWallTouchAnotherWall(move >> 2):
             blocksVictory = False
 
         else:
-            for player in [0, 1]:
-                if not graph_algorithms.greedyBestFirst(self, player):
+            for player in playersCut:
+                if not self.canReachGoal(self, player):
                     blocksVictory = True
                     break
 
-        self._undoWallMove(wallChar + str(wall))
+        self._removeWall(move)
 
         return blocksVictory
 
@@ -287,15 +675,16 @@ class QuoridorGameState(object):
         # More sophisticated versions of this would be to keep track of
         # chains of walls, and only make the DFS check if a chain is closed
 
+        # self.distance holds cell offsets; vertex rows are vertexSize apart
         N, S, E, W = self._getVertexVertexNeighbors(wall)
-        N2 = N + self.distance['N']
-        S2 = S + self.distance['S']
-        E2 = E + self.distance['E']
-        W2 = W + self.distance['W']
-        NE = N + self.distance['E']
-        NW = N + self.distance['W']
-        SE = S + self.distance['E']
-        SW = S + self.distance['W']
+        N2 = N - self.vertexSize
+        S2 = S + self.vertexSize
+        E2 = E + 1
+        W2 = W - 1
+        NE = N + 1
+        NW = N - 1
+        SE = S + 1
+        SW = S - 1
 
         if self._isHorizontalWall(wall):
             return self._isVerticalWall(NW) or self._isVerticalWall(N) \
@@ -395,10 +784,12 @@ class QuoridorGameState(object):
             )
 
     def _createVertexCellGraph(self):
+        # Neighbors are sorted, i.e. in NW, NE, SW, SE order for non-rim
+        # vertices
         self.vertexCellGraph = []
         for vertex in xrange(self.numVertexes):
             self.vertexCellGraph.append(
-                self._getVertexCellNeighbors(vertex)
+                sorted(self._getVertexCellNeighbors(vertex))
             )
 
     def _createEdgeWallGraph(self):
@@ -426,13 +817,54 @@ class QuoridorGameState(object):
             # If a valid eastern neighbor exists, add it to the graph.
             # Only vertical walls can block an eastern movement.
             if E:
-                self.edgeWallGraph[(c, E)] = ['v' + str(v) for v in [NE, SE]
-                                                if v in self.nonRimWalls]
+                self.edgeWallGraph[(c, E)] = [v << 2 | MoveType.VERTICAL
+                                              for v in [NE, SE]
+                                              if v in self.nonRimWalls]
             # If a valid southern neighbor exists, add it to the graph.
             # Only horizontal walls can block a southern movement.
             if S:
-                self.edgeWallGraph[(c, S)] = ['h' + str(v) for v in [SW, SE]
-                                                if v in self.nonRimWalls]
+                self.edgeWallGraph[(c, S)] = [v << 2 | MoveType.HORIZONTAL
+                                              for v in [SW, SE]
+                                              if v in self.nonRimWalls]
+
+    def _createWallConflictGraph(self):
+        """
+        Numbers the wall slots and records which slots each wall takes away.
+        The vertical wall at vertex v is slot 2v and the horizontal wall is
+        slot 2v + 1. Placing a wall blocks its own slot, the crossing wall
+        at the same vertex, and the two overlapping walls of the same
+        orientation on either side of it. Also records the wall move of each
+        slot and the two cell-cell edges each wall cuts, both as cell pairs
+        and as the bits of those edges in openEast (for a vertical wall) or
+        openSouth (for a horizontal wall). boardWallMoves lists the wall
+        moves of every slot on the board.
+        """
+
+        self.wallSlotMoves = [None] * (2 * self.numVertexes)
+        self.wallConflicts = [[] for _ in xrange(2 * self.numVertexes)]
+        self.wallEdges = [() for _ in xrange(2 * self.numVertexes)]
+        self.wallCutBits = [0] * (2 * self.numVertexes)
+
+        nonRimWalls = set(self.nonRimWalls)
+        for v in self.nonRimWalls:
+            N, S, E, W = self._getVertexVertexNeighbors(v)
+
+            self.wallSlotMoves[2 * v] = v << 2 | MoveType.VERTICAL
+            self.wallSlotMoves[2 * v + 1] = v << 2 | MoveType.HORIZONTAL
+
+            self.wallConflicts[2 * v] = [2 * v, 2 * v + 1] + \
+                [2 * u for u in (N, S) if u in nonRimWalls]
+            self.wallConflicts[2 * v + 1] = [2 * v, 2 * v + 1] + \
+                [2 * u + 1 for u in (E, W) if u in nonRimWalls]
+
+            NW, NE, SW, SE = self.vertexCellGraph[v]
+            self.wallEdges[2 * v] = ((NW, NE), (SW, SE))
+            self.wallEdges[2 * v + 1] = ((NW, SW), (NE, SE))
+            self.wallCutBits[2 * v] = 1 << NW | 1 << SW
+            self.wallCutBits[2 * v + 1] = 1 << NW | 1 << NE
+
+        self.boardWallMoves = [move for move in self.wallSlotMoves
+                               if move is not None]
 
     def _isVerticalWall(self, wall):
         if wall < 0 or wall >= self.numVertexes:
@@ -493,10 +925,15 @@ def playGame():
     move = ''
     while move != 'q' or q.winner is None:
         print q
-        print q.getLegalMoves()
+        legalMoves = q.getLegalMoves()
+        print map(formatMove, legalMoves)
         move = raw_input('Enter Move: ')
-        if move in q.getLegalMoves():
-            q.executeMove(move)
+        try:
+            parsedMove = parseMove(move)
+        except (ValueError, IndexError):
+            parsedMove = None
+        if parsedMove in legalMoves:
+            q.executeMove(parsedMove)
         else:
             print 'Invalid move: ', move
 
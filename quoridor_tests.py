@@ -1,8 +1,19 @@
+import multiprocessing
+import os
+import tempfile
 import time
 import random
 
 from quoridor import *
+import arraytree
+import connectfour
 import graph_algorithms
+import mcts
+import openingbook
+import policies
+import solver
+import tictactoe
+import treefile
 
 def testValidPawnMovesTiming():
     print "TEST: testValidPawnMovesTiming()"
@@ -66,13 +77,13 @@ def testNeighborRemoval():
 
     q = QuoridorGameState()
 
-    q.executeMove('h23')
+    q.executeMove(parseMove('h23'))
     assert 20 not in q.cellGraph[11]
     assert 11 not in q.cellGraph[20]
     assert 21 not in q.cellGraph[12]
     assert 12 not in q.cellGraph[21]
 
-    q.executeMove('v15')
+    q.executeMove(parseMove('v15'))
     assert 4 not in q.cellGraph[5]
     assert 5 not in q.cellGraph[4]
     assert 13 not in q.cellGraph[14]
@@ -83,56 +94,68 @@ def testHorizontalWallPlacement():
     print "TEST: testHorizontalWallPlacement()"
 
     q = QuoridorGameState()
-    q.executeMove('h11')
+    q.executeMove(parseMove('h11'))
     legalMoves = q.getLegalMoves()
 
     # Test that it and its neighbor are no longer valid moves
-    assert 'h11' not in legalMoves
-    assert 'h12' not in legalMoves
+    assert parseMove('h11') not in legalMoves
+    assert parseMove('h12') not in legalMoves
 
     # Test that a vertical wall can't be placed in the same spot
-    assert 'v11' not in legalMoves
+    assert parseMove('v11') not in legalMoves
 
     # Test that a vertical wall can be placed below it
-    assert 'v21' in legalMoves
+    assert parseMove('v21') in legalMoves
 
 
 def testWallBlockingOpponentVictory():
     print "TEST: testWallBlockingOpponentVictory()"
 
     q = QuoridorGameState()
-    q.executeMove('h41')
-    q.executeMove('h43')
-    q.executeMove('h45')
-    q.executeMove('h47')
-    q.executeMove('v48')
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+    q.executeMove(parseMove('h45'))
+    q.executeMove(parseMove('h47'))
+    q.executeMove(parseMove('v48'))
     print q
 
     legalMoves = q.getLegalMoves()
-    assert 'h38' not in legalMoves
-    assert 'h58' not in legalMoves
+    assert parseMove('h38') not in legalMoves
+    assert parseMove('h58') not in legalMoves
 
 def testWallBlockingSelfVictory():
     print "TEST: testWallBlockingSelfVictory()"
 
     q = QuoridorGameState()
-    q.executeMove('v84')
-    q.executeMove('h85')
+    q.executeMove(parseMove('v84'))
+    q.executeMove(parseMove('h85'))
     print q
 
-    assert 'v86' not in q.getLegalMoves()
+    assert parseMove('v86') not in q.getLegalMoves()
+
+def testWallBlockingThroughWallEnds():
+    print "TEST: testWallBlockingThroughWallEnds()"
+
+    # v62 closes the box around player 1 and only touches the vertical
+    # walls above and below it, end to end
+    q = QuoridorGameState()
+    for move in ['h33', 'h35', 'v42', 'v82', 'v46', 'v66', 'v86']:
+        q.executeMove(parseMove(move))
+    print q
+
+    assert parseMove('v62') not in q.getLegalMoves()
 
 
 def testPrintBoard():
     print "TEST: testPrintBoard()"
 
     q = QuoridorGameState()
-    q.executeMove('h24')
-    q.executeMove('v25')
-    q.executeMove('h11')
-    q.executeMove('h13')
-    q.executeMove('13')
-    q.executeMove('67')
+    q.executeMove(parseMove('h24'))
+    q.executeMove(parseMove('v25'))
+    q.executeMove(parseMove('h11'))
+    q.executeMove(parseMove('h13'))
+    q.executeMove(parseMove('13'))
+    q.executeMove(parseMove('67'))
     print q
 
 
@@ -140,11 +163,11 @@ def testBridgeAlgorithm():
     print "TEST: testBridgeAlgorithm()"
 
     q = QuoridorGameState()
-    q.executeMove('h41')
-    q.executeMove('h43')
-    q.executeMove('h45')
-    q.executeMove('h47')
-    q.executeMove('v48')
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+    q.executeMove(parseMove('h45'))
+    q.executeMove(parseMove('h47'))
+    q.executeMove(parseMove('v48'))
 
     bridges = graph_algorithms.bridge(q.cellGraph, q.playerPositions[0],
                                       q.numCells + 2)
@@ -156,11 +179,11 @@ def testBridgeTiming():
     print "TEST: testBridgeTiming()"
 
     q = QuoridorGameState()
-    q.executeMove('h41')
-    q.executeMove('h43')
-    q.executeMove('h45')
-    q.executeMove('h47')
-    q.executeMove('v48')
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+    q.executeMove(parseMove('h45'))
+    q.executeMove(parseMove('h47'))
+    q.executeMove(parseMove('v48'))
 
     times = []
     for _ in xrange(10000):
@@ -177,11 +200,11 @@ def testGetLegalMovesTiming():
     print "TEST: testGetLegalMovesTiming()"
 
     q = QuoridorGameState()
-    q.executeMove('h41')
-    q.executeMove('h43')
-    q.executeMove('h45')
-    q.executeMove('h47')
-    q.executeMove('v48')
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+    q.executeMove(parseMove('h45'))
+    q.executeMove(parseMove('h47'))
+    q.executeMove(parseMove('v48'))
 
     times = []
     for _ in xrange(1000):
@@ -194,15 +217,1119 @@ def testGetLegalMovesTiming():
     print "Max time: ", str(max(times))
 
 
+def testFloodFillReachable():
+    print "TEST: testFloodFillReachable()"
+
+    # Player 1 is boxed in at the bottom, player 2 is free
+    q = QuoridorGameState()
+    for move in ['v84', 'v86', 'h75']:
+        q._placeWall(parseMove(move))
+    assert not graph_algorithms.floodFillReachable(q, 0)
+    assert graph_algorithms.floodFillReachable(q, 1)
+    for move in ['v84', 'v86', 'h75']:
+        q._removeWall(parseMove(move))
+    assert q.openEast == q.emptyOpenEast
+    assert q.openSouth == q.emptyOpenSouth
+
+    # Both searches agree on every wall tried in random games
+    random.seed(15)
+    for _ in xrange(5):
+        q = QuoridorGameState()
+        while q.winner is None:
+            for slot, move in enumerate(q.wallSlotMoves):
+                if not q.placeableWalls & 1 << slot:
+                    continue
+                q._placeWall(move)
+                for player in [0, 1]:
+                    assert graph_algorithms.floodFillReachable(q, player) == \
+                        graph_algorithms.greedyBestFirst(q, player)
+                q._removeWall(move)
+            q.executeMove(random.choice(q.getLegalMoves()))
+
+
+def testReachabilityTiming():
+    print "TEST: testReachabilityTiming()"
+
+    q = QuoridorGameState()
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+    q.executeMove(parseMove('h45'))
+    q.executeMove(parseMove('h47'))
+    q.executeMove(parseMove('v48'))
+
+    for search in [graph_algorithms.greedyBestFirst,
+                   graph_algorithms.floodFillReachable]:
+        times = []
+        for _ in xrange(10000):
+            start = time.clock()
+            search(q, 0)
+            search(q, 1)
+            end = time.clock()
+            times.append(end - start)
+
+        print search.__name__
+        print "Average time: ", str(float(sum(times)) / float(len(times)))
+        print "Max time: ", str(max(times))
+
+
+def testMoveCandidates():
+    print "TEST: testMoveCandidates()"
+
+    # The legal candidates are exactly the legal moves
+    random.seed(20)
+    for _ in xrange(3):
+        q = QuoridorGameState()
+        while q.winner is None:
+            legalMoves = q.getLegalMoves()
+            candidates = [move for move in q.getMoveCandidates()
+                          if q.isLegalCandidate(move)]
+            assert sorted(candidates) == sorted(legalMoves)
+            q.executeMove(random.choice(legalMoves))
+
+
+def testFrontier():
+    print "TEST: testFrontier()"
+
+    # The expanded moves and the frontier split the legal moves between
+    # them, whether the candidates are checked lazily or not
+    random.seed(20)
+    for gamestate, nodeClass in [
+            (QuoridorGameState(), mcts.MCTSNode),
+            (QuoridorGameState(), mcts.StatelessMCTSNode),
+            (tictactoe.TicTacToeGameState(), mcts.MCTSNode)]:
+        root = nodeClass(gamestate)
+        for iterations in [0, 1, 5]:
+            mcts.search(root, iterations)
+            frontier = root.frontier
+            assert not set(frontier) & set(root.children)
+            assert sorted(frontier + root.children.keys()) == \
+                sorted(gamestate.getLegalMoves())
+
+    # Unexpanded moves count as runners-up with no visits
+    root = mcts.MCTSNode(tictactoe.TicTacToeGameState())
+    mcts.search(root, 1)
+    assert len(root.children) == 1 and len(root.frontier) == 8
+    assert mcts.isSearchDecided(root, 0)
+    assert not mcts.isSearchDecided(root, 1)
+
+    ttt = tictactoe.TicTacToeGameState()
+    for move in [0, 1, 2, 4, 3, 5, 7, 6]:
+        ttt.executeMove(move)
+    assert ttt.winner is None
+    assert mcts.isSearchDecided(mcts.MCTSNode(ttt), 100)
+
+
+def testSampleRandomLegalMove():
+    print "TEST: testSampleRandomLegalMove()"
+
+    # Sampled moves are always legal
+    random.seed(21)
+    for _ in xrange(3):
+        q = QuoridorGameState()
+        while q.winner is None:
+            move = q.sampleRandomLegalMove()
+            assert move in q.getLegalMoves()
+            q.executeMove(move)
+
+    # and uniform over the legal moves, including next to walls that would
+    # block a player and so are drawn and rejected
+    q = QuoridorGameState()
+    for move in ['v84', 'v86']:
+        q.executeMove(parseMove(move))
+    legalMoves = q.getLegalMoves()
+
+    samples = 200 * len(legalMoves)
+    counts = dict((move, 0) for move in legalMoves)
+    for _ in xrange(samples):
+        counts[q.sampleRandomLegalMove()] += 1
+
+    assert len(counts) == len(legalMoves)
+    for count in counts.itervalues():
+        assert 120 < count < 280
+
+
+def testShortestPathMove():
+    print "TEST: testShortestPathMove()"
+
+    # Both pawns start 8 rows from their goal and head straight for it
+    q = QuoridorGameState()
+    assert q.distanceToGoal(1) == 8
+    assert q.distanceToGoal(2) == 8
+    assert q.getShortestPathMove() == parseMove('67')
+
+    # A wall in front of player 1 makes them step around it
+    q.executeMove(parseMove('h84'))
+    q.executeMove(parseMove('13'))
+    assert q.distanceToGoal(1) == 9
+    assert q.getShortestPathMove() == parseMove('77')
+
+
+def testDecidedWinner():
+    print "TEST: testDecidedWinner()"
+
+    # Undecided while anyone has a wall to place
+    q = QuoridorGameState()
+    assert q.getDecidedWinner() is None
+    q.numPlayerWalls = [0, 1]
+    assert q.getDecidedWinner() is None
+
+    # Player 1 is to move and as far from the goal as player 2
+    q.numPlayerWalls = [0, 0]
+    assert q.getDecidedWinner() == 1
+
+    # Once the walls run out, the race result is what both players walking
+    # their shortest paths get
+    random.seed(23)
+    checked = 0
+    while checked < 20:
+        q = QuoridorGameState()
+        while q.winner is None and (q.numPlayerWalls[0] or
+                                    q.numPlayerWalls[1]):
+            q.executeMove(q.sampleRandomLegalMove())
+        if q.winner is not None:
+            continue
+
+        decided = q.getDecidedWinner()
+        while q.winner is None:
+            q.executeMove(q.getShortestPathMove())
+        assert decided == q.winner
+        checked += 1
+
+    # A rollout stops as soon as the winner is decided and scores it for
+    # the player who just moved, without playing the race out
+    for moves, reward in [([], -1), (['67'], 1)]:
+        q = QuoridorGameState()
+        for move in moves:
+            q.executeMove(parseMove(move))
+        q.numPlayerWalls = [0, 0]
+        position = (q.hash, q.playerPositions[:], q.currentPlayer)
+        stats = mcts.SearchStats()
+        assert mcts.rollout(q, stats) == reward
+        assert (q.hash, q.playerPositions, q.currentPlayer) == position
+        assert stats.rollouts == 1 and stats.rolloutMoves == 0
+
+    # Started with one wall left, a rollout never plays on past the move
+    # that places it
+    class UndecidedPolicy(mcts.RolloutPolicy):
+        def selectMove(self, gamestate):
+            assert gamestate.getDecidedWinner() is None
+            return gamestate.sampleRandomLegalMove()
+
+    for _ in xrange(10):
+        q = QuoridorGameState()
+        q.numPlayerWalls = [1, 0]
+        mcts.rollout(q, policy=UndecidedPolicy())
+        assert q.winner is not None or q.numPlayerWalls == [0, 0]
+
+
+def testZobristHash():
+    print "TEST: testZobristHash()"
+
+    # The same walls placed in a different order give the same position
+    q1 = QuoridorGameState()
+    q1.executeMove(parseMove('h23'))
+    q1.executeMove(parseMove('v47'))
+    q2 = QuoridorGameState()
+    q2.executeMove(parseMove('v47'))
+    q2.executeMove(parseMove('h23'))
+    assert q1.hash == q2.hash
+    assert q1.copy().hash == q1.hash
+
+    # Moving a pawn away and back leaves the same player to move
+    q3 = QuoridorGameState()
+    start = q3.hash
+    q3.executeMove(parseMove('67'))
+    q3.executeMove(parseMove('13'))
+    assert q3.hash != start
+    q3.executeMove(parseMove('76'))
+    q3.executeMove(parseMove('4'))
+    assert q3.hash == start
+
+    # Trying a wall during legal move generation leaves the hash unchanged
+    before = q1.hash
+    q1.getLegalMoves()
+    assert q1.hash == before
+
+
+def testPlaceableWallTracking():
+    print "TEST: testPlaceableWallTracking()"
+
+    def freeSlots(q):
+        # Recompute the free wall slots from scratch
+        slots = 0
+        for v in q.nonRimWalls:
+            N, S, E, W = q._getVertexVertexNeighbors(v)
+            if q.walls[v] == WallType.EMPTY:
+                if not q.walls[N] & WallType.VERTICAL and \
+                        not q.walls[S] & WallType.VERTICAL:
+                    slots |= 1 << 2 * v
+                if not q.walls[E] & WallType.HORIZONTAL and \
+                        not q.walls[W] & WallType.HORIZONTAL:
+                    slots |= 1 << 2 * v + 1
+        return slots
+
+    q = QuoridorGameState()
+    initial = q.placeableWalls
+    for move in ['h23', 'h25', 'v24', 'v47', 'h65']:
+        q.executeMove(parseMove(move))
+        assert q.placeableWalls == freeSlots(q)
+
+    # Walls are given back to the player who placed them
+    for move, player in [('h65', 1), ('v47', 2), ('v24', 1), ('h25', 2),
+                         ('h23', 1)]:
+        q.currentPlayer = player
+        q._undoWallMove(parseMove(move))
+        assert q.placeableWalls == freeSlots(q)
+
+    assert q.placeableWalls == initial
+
+
+def testShortestPathCache():
+    print "TEST: testShortestPathCache()"
+
+    def isPathToGoal(q, player):
+        path = q.shortestPaths[player]
+        goal = [q.PLAYER1_GOAL, q.PLAYER2_GOAL][player]
+        return path[0] == q.playerPositions[player] and \
+            goal in q.cellGraph[path[-1]] and \
+            all(v in q.cellGraph[u] for u, v in zip(path, path[1:]))
+
+    q = QuoridorGameState()
+    for move in ['h41', 'h43', 'h45', '13', 'h47', '67', '14']:
+        q.executeMove(parseMove(move))
+        q.getLegalMoves()
+        for player in [0, 1]:
+            assert isPathToGoal(q, player)
+            assert len(q.shortestPaths[player]) == \
+                len(graph_algorithms.shortestPath(q, player))
+
+
+def testCopy():
+    print "TEST: testCopy()"
+
+    q = QuoridorGameState()
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+    q.executeMove(parseMove('h45'))
+    q.executeMove(parseMove('h47'))
+    q.executeMove(parseMove('v48'))
+
+    # The copy keeps the edges removed by the walls
+    c = q.copy()
+    assert c.cellGraph == q.cellGraph
+    assert 36 not in c.cellGraph[27]
+    assert sorted(c.getLegalMoves()) == sorted(q.getLegalMoves())
+
+    # The copies do not share dynamic state
+    c.executeMove(parseMove('13'))
+    c.executeMove(parseMove('h12'))
+    assert parseMove('h12') in q.getLegalMoves()
+    assert parseMove('h12') not in c.getLegalMoves()
+    assert q.playerPositions != c.playerPositions
+
+    # But they do share the static tables
+    assert c.edgeWallGraph is q.edgeWallGraph
+
+
+def testCopyTiming():
+    print "TEST: testCopyTiming()"
+
+    q = QuoridorGameState()
+    q.executeMove(parseMove('h41'))
+    q.executeMove(parseMove('h43'))
+
+    times = []
+    for _ in xrange(10000):
+        start = time.clock()
+        q.copy()
+        end = time.clock()
+        times.append(end - start)
+
+    print "Average time: ", str(float(sum(times)) / float(len(times)))
+    print "Max time: ", str(max(times))
+
+
+def testUndoMove():
+    print "TEST: testUndoMove()"
+
+    def snapshot(q):
+        return (list(q.walls), [sorted(n) for n in q.cellGraph],
+                list(q.playerPositions), list(q.numPlayerWalls),
+                q.placeableWalls, q.currentPlayer, q.winner, q.hash)
+
+    q = QuoridorGameState()
+    q.trackUndo = True
+    snapshots = []
+    for move in ['h41', '67', 'h43', '13', 'v48', '58', '22', '49', '31',
+                 '40', '4']:
+        snapshots.append(snapshot(q))
+        q.executeMove(parseMove(move))
+    assert q.winner == 1
+
+    while snapshots:
+        q.undoMove()
+        assert snapshot(q) == snapshots.pop()
+
+    assert q.moveStack == []
+
+    # Copies start without tracking, and untracked moves are not recorded
+    assert q.copy().trackUndo is False
+    q = QuoridorGameState()
+    q.executeMove(parseMove('67'))
+    assert q.moveStack == []
+
+
+def testUnmakeSearch():
+    print "TEST: testUnmakeSearch()"
+
+    def snapshot(gamestate):
+        # Everything a copy holds, which is the whole position
+        return dict((name, value)
+                    for name, value in gamestate.copy().__dict__.iteritems()
+                    if name not in ('moveStack', 'trackUndo'))
+
+    def treeStatistics(node):
+        return (node.visits, node.value,
+                sorted((move, treeStatistics(child))
+                       for move, child in node.children.iteritems()))
+
+    # Moves are only recorded for undoMove on request. Searching on the root
+    # state and taking every move back grows the same tree as searching on
+    # copies, and leaves the root state as it was.
+    for gamestate, iterations in [(tictactoe.TicTacToeGameState(), 300),
+                                  (connectfour.ConnectFourGameState(), 300),
+                                  (connectfour.BitboardConnectFourGameState(),
+                                   300),
+                                  (QuoridorGameState(), 20)]:
+        random.seed(13)
+        for _ in xrange(2):
+            gamestate.executeMove(random.choice(gamestate.getLegalMoves()))
+        assert gamestate.moveStack == []
+        before = snapshot(gamestate)
+
+        random.seed(14)
+        root = mcts.StatelessMCTSNode(gamestate.copy())
+        mcts.search(root, iterations)
+
+        random.seed(14)
+        unmadeRoot = mcts.StatelessMCTSNode(gamestate)
+        mcts.search(unmadeRoot, iterations, unmake=True)
+
+        assert gamestate.moveStack == []
+        assert snapshot(gamestate) == before
+        assert treeStatistics(unmadeRoot) == treeStatistics(root)
+
+
+def testTreeFile():
+    print "TEST: testTreeFile()"
+
+    def statistics(node, gamestate):
+        # Every node's statistics by the moves leading to it, reading any
+        # children still in the tree file
+        node._loadStoredChildren(gamestate)
+        result = {(): (node.visits, node.value)}
+        for move, child in node.children.iteritems():
+            gamestate.executeMove(move)
+            for moves, stats in statistics(child, gamestate).iteritems():
+                result[(move,) + moves] = stats
+            gamestate.undoMove()
+        return result
+
+    def treeStatistics(root):
+        gamestate = root.gamestate.copy()
+        gamestate.trackUndo = True
+        return statistics(root, gamestate)
+
+    random.seed(24)
+    root = mcts.StatelessMCTSNode(QuoridorGameState())
+    mcts.search(root, 200)
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        numNodes = treefile.saveTree(root, path)
+        assert numNodes == len(treeStatistics(root))
+
+        loaded = treefile.loadTree(path, QuoridorGameState(),
+                                   mcts.StatelessMCTSNode)
+        assert loaded.rootStatistics() == root.rootStatistics()
+
+        # Saving copies the part of the tree not read yet straight from the
+        # file, without building its nodes
+        assert treefile.saveTree(loaded, path) == numNodes
+        assert all(child.children == {}
+                   for child in loaded.children.itervalues())
+        assert treeStatistics(loaded) == treeStatistics(root)
+
+        # The search carries on from the stored statistics, and saving over
+        # the file the tree is still mapped from keeps the unread part
+        loaded = treefile.loadTree(path, QuoridorGameState(),
+                                   mcts.StatelessMCTSNode)
+        mcts.search(loaded, 50)
+        assert loaded.visits == root.visits + 50
+        treefile.saveTree(loaded, path)
+        reloaded = treefile.loadTree(path, QuoridorGameState(),
+                                     mcts.StatelessMCTSNode)
+        assert treeStatistics(reloaded) == treeStatistics(loaded)
+
+        # A tree only loads for the position it was saved from
+        q = QuoridorGameState()
+        q.executeMove(parseMove('67'))
+        try:
+            treefile.loadTree(path, q, mcts.StatelessMCTSNode)
+            assert False
+        except ValueError:
+            pass
+    finally:
+        os.remove(path)
+
+
+def testTreeFileAfterReroot():
+    print "TEST: testTreeFileAfterReroot()"
+
+    def visitedNodes(node, seen):
+        # Reads the whole loaded DAG, checking each node has been visited
+        if id(node) in seen:
+            return
+        seen.add(id(node))
+        node._loadStoredChildren(node.gamestate)
+        for child in node.children.itervalues():
+            assert child.visits > 0
+            visitedNodes(child, seen)
+
+    # Moves played before any search, as book moves are, leave the opening
+    # position without children
+    random.seed(25)
+    cf = connectfour.BitboardConnectFourGameState()
+    table = mcts.TranspositionTable(symmetric=True)
+    root = mcts.TranspositionMCTSNode(cf.copy(), table=table)
+    node = root.reroot(3).reroot(3)
+    for move in [3, 3]:
+        cf.executeMove(move)
+    mcts.search(node, 500)
+    assert root.children == {}
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        for saved, gamestate in [(root, root.gamestate), (node, cf)]:
+            numNodes = treefile.saveTree(saved, path)
+            loaded = treefile.loadTree(path, gamestate.copy(),
+                                       mcts.TranspositionMCTSNode,
+                                       mcts.TranspositionTable(True))
+            assert loaded.visits == saved.visits
+            mcts.mcts(loaded, 100)
+            assert loaded.visits == saved.visits + 100
+
+        seen = set()
+        visitedNodes(loaded, seen)
+        assert len(seen) >= numNodes
+    finally:
+        os.remove(path)
+
+
+def testOpeningBook():
+    print "TEST: testOpeningBook()"
+
+    q = QuoridorGameState()
+    positions = openingbook.expandPositions(q, 1)
+    assert len(positions) == 1 + len(q.getLegalMoves())
+    assert len(set(position.hash for position in positions)) == \
+        len(positions)
+
+    random.seed(25)
+    progress = []
+    entries = openingbook.buildBook(
+        q, 0, 20, numWorkers=1, nodeClass=mcts.StatelessMCTSNode,
+        progress=lambda done, total: progress.append((done, total)))
+    assert len(entries) == 1 and entries[0][0] == q.hash
+    assert progress == [(1, 1)]
+
+    # A pawn move no pawn can make, as a hash collision would give
+    entries.append((positions[1].hash, parseMove('40'), 7, -2.5))
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        openingbook.writeBook(entries, path)
+        book = openingbook.OpeningBook(path)
+        assert len(book) == 2
+        assert book.lookup(q) == entries[0][1]
+        assert book.entry(positions[1]) == (parseMove('40'), 7, -2.5)
+        assert book.lookup(positions[1]) is None
+        assert book.entry(positions[2]) is None
+    finally:
+        os.remove(path)
+
+
+def testReroot():
+    print "TEST: testReroot()"
+
+    random.seed(1)
+    for nodeClass in [mcts.MCTSNode, mcts.StatelessMCTSNode]:
+        cf = connectfour.BitboardConnectFourGameState()
+        root = nodeClass(cf.copy())
+        mcts.search(root, 12)
+
+        # The searched move keeps its subtree and statistics
+        move = root.selectBestMove()
+        child = root.children[move]
+        visits, value = child.visits, child.value
+        root = root.reroot(move)
+        cf.executeMove(move)
+        assert root is child
+        assert (root.visits, root.value) == (visits, value)
+        assert root.parent is None
+        assert root.gamestate.hash == cf.hash
+
+        # A reply the search never tried gets a fresh root, which is left
+        # out of the old tree so that no child there goes unvisited
+        reply = root.frontier[0]
+        oldRoot, root = root, root.reroot(reply)
+        cf.executeMove(reply)
+        assert reply not in oldRoot.children
+        assert reply in oldRoot.frontier
+        assert all(child.visits > 0
+                   for child in oldRoot.children.itervalues())
+        assert (root.visits, root.value) == (0, 0)
+        assert root.parent is None and root.move == reply
+        assert root.gamestate.hash == cf.hash
+        assert root.gamestate.board == cf.board
+
+        mcts.search(root, 20)
+        assert root.visits == 20
+
+
+def testTranspositionReroot():
+    print "TEST: testTranspositionReroot()"
+
+    def reachableNodes(root):
+        nodes = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node not in nodes:
+                nodes.add(node)
+                stack.extend(node.children.itervalues())
+        return nodes
+
+    # After each reroot the table holds exactly the nodes reachable from the
+    # new root, and no parent link leads back into the dropped part
+    random.seed(9)
+    cf = connectfour.BitboardConnectFourGameState()
+    root = mcts.TranspositionMCTSNode(cf.copy())
+    for _ in xrange(6):
+        move = mcts.mcts(root, 300)
+        root = root.reroot(move)
+        cf.executeMove(move)
+        nodes = reachableNodes(root)
+        assert len(root.table) == len(nodes)
+        assert set(root.table.nodes.itervalues()) == nodes
+        assert root.parent is None
+        assert all(node.parent is None or node.parent in nodes
+                   for node in nodes)
+
+    # With a symmetric table, the opening moves into either outer column
+    # share a node. Rerooting onto the one the node does not hold turns
+    # the node around instead of starting over.
+    random.seed(10)
+    cf = connectfour.BitboardConnectFourGameState()
+    table = mcts.TranspositionTable(symmetric=True)
+    root = mcts.TranspositionMCTSNode(cf.copy(), table=table)
+    mcts.search(root, 300)
+    child = root.children[0]
+    assert root.children[cf.mirrorMove(0)] is child
+    position = cf.copy()
+    position.executeMove(0)
+    move = 0 if child.gamestate.hash != position.hash else cf.mirrorMove(0)
+    visits, value = child.visits, child.value
+    root = root.reroot(move)
+    cf.executeMove(move)
+    assert root is child
+    assert (root.visits, root.value) == (visits, value)
+    assert root.gamestate.hash == cf.hash and root.move == move
+    assert (sorted(root.children.keys() + root.frontier) ==
+            sorted(cf.getLegalMoves()))
+    for reply, grandchild in root.children.iteritems():
+        position = cf.copy()
+        position.executeMove(reply)
+        assert table.key(grandchild.gamestate) == table.key(position)
+
+    mcts.search(root, 100)
+    assert root.visits == visits + 100
+
+
+def testTreeParallelMCTS():
+    print "TEST: testTreeParallelMCTS()"
+
+    def treeNodes(root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.itervalues())
+
+    random.seed(19)
+    pool = multiprocessing.Pool(2)
+    try:
+        for nodeClass, threadRollouts in [(mcts.MCTSNode, False),
+                                          (mcts.StatelessMCTSNode, True)]:
+            root = nodeClass(tictactoe.TicTacToeGameState())
+            move = mcts.treeParallelMCTS(root, 200, numWorkers=3, pool=pool,
+                                         threadRollouts=threadRollouts)
+            assert move in root.children
+            assert root.visits == 200
+            assert all(node.pending == 0 for node in treeNodes(root))
+    finally:
+        pool.close()
+        pool.join()
+
+    # A rollout in flight through a child counts as a lost visit there
+    child = root.children[move]
+    before = root.uct(child)
+    mcts.addVirtualLoss([root, child], 1)
+    assert root.uct(child) < before
+    mcts.addVirtualLoss([root, child], -1)
+    assert root.uct(child) == before
+
+
+def testLeafParallelMCTS():
+    print "TEST: testLeafParallelMCTS()"
+
+    # One rollout is backed up per dispatched leaf, including those still
+    # in flight when the budget runs out
+    random.seed(4)
+    pool = multiprocessing.Pool(2)
+    try:
+        for nodeClass in [mcts.MCTSNode, mcts.StatelessMCTSNode]:
+            root = nodeClass(tictactoe.TicTacToeGameState())
+            move = mcts.leafParallelMCTS(root, 150, maxInFlight=4, pool=pool)
+            assert move in root.children
+            assert root.visits == 150
+            assert root.pending == 0
+            assert all(child.pending == 0
+                       for child in root.children.itervalues())
+
+        # Pending counts follow parent links, which a DAG does not have
+        root = mcts.TranspositionMCTSNode(tictactoe.TicTacToeGameState())
+        rejected = False
+        try:
+            mcts.leafParallelMCTS(root, 10, pool=pool)
+        except AssertionError:
+            rejected = True
+        assert rejected and root.visits == 0
+    finally:
+        pool.close()
+        pool.join()
+
+
+def testRootParallelMCTS():
+    print "TEST: testRootParallelMCTS()"
+
+    random.seed(3)
+    ttt = tictactoe.TicTacToeGameState()
+    pool = multiprocessing.Pool(2)
+    try:
+        move = mcts.rootParallelMCTS(ttt, 40, numTrees=4, pool=pool)
+        assert move in ttt.getLegalMoves()
+
+        # Each tree is reseeded, so trees with different seeds differ and
+        # trees with the same seed agree, whichever process grows them
+        jobs = [(ttt, 10, None, seed, mcts.MCTSNode, None)
+                for seed in [1, 2, 1, 1]]
+        statisticsList = pool.map(mcts._rootParallelWorker, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    assert statisticsList[0] == statisticsList[2] == statisticsList[3]
+    assert statisticsList[0] != statisticsList[1]
+
+    # The merged statistics hold every tree's visits and values
+    merged = mcts.mergeStatistics(statisticsList)
+    assert sum(visits for visits, _ in merged.itervalues()) == 4 * 10
+    for move, (visits, value) in merged.iteritems():
+        assert visits == sum(statistics.get(move, (0, 0))[0]
+                             for statistics in statisticsList)
+        assert value == sum(statistics.get(move, (0, 0))[1]
+                            for statistics in statisticsList)
+
+
+def testBatchRollout():
+    print "TEST: testBatchRollout()"
+
+    # Batch rollouts need NumPy, which nothing else here does
+    import batchrollouts
+
+    # Whatever is played from either position, the game ends the same way.
+    # The reward is for O, who just moved: X completes a line after
+    # 0 1 2 3 4 5, and O does after 0 2 1 4 7 5.
+    random.seed(8)
+    batchrollouts.numpy.random.seed(8)
+    for moves, reward in [([0, 1, 2, 3, 4, 5], -1), ([0, 2, 1, 4, 7, 5], 1)]:
+        ttt = tictactoe.TicTacToeGameState()
+        for move in moves:
+            ttt.executeMove(move)
+        assert ttt.winner is None
+
+        rewards = batchrollouts.batchRollout([ttt] * 20)
+        assert list(rewards) == [reward] * 20
+        assert all(mcts.rollout(ttt.copy()) == reward for _ in xrange(20))
+        assert ttt.winner is None
+
+    root = mcts.MCTSNode(tictactoe.TicTacToeGameState())
+    batchrollouts.batchMCTS(root, 20, rolloutsPerLeaf=8)
+    assert root.visits == 20 * 8
+
+    root = mcts.TranspositionMCTSNode(tictactoe.TicTacToeGameState())
+    rejected = False
+    try:
+        batchrollouts.batchMCTS(root, 10)
+    except AssertionError:
+        rejected = True
+    assert rejected and root.visits == 0
+
+
+def testSearchStats():
+    print "TEST: testSearchStats()"
+
+    def treeSize(node):
+        return 1 + sum(treeSize(child) for child in node.children.itervalues())
+
+    random.seed(18)
+    snapshots = []
+    stats = mcts.SearchStats(snapshots.append, snapshotInterval=1)
+    root = mcts.MCTSNode(tictactoe.TicTacToeGameState())
+    mcts.search(root, 200, stats=stats)
+
+    # Every iteration ends in one rollout, which makes one timed move
+    # selection per move played, and creates at most one node
+    assert stats.iterations == stats.rollouts == root.visits == 200
+    assert stats.moveSelectionCalls == {
+        'TicTacToeGameState': stats.rolloutMoves}
+    assert stats.nodesCreated == treeSize(root) - 1
+    assert 0 < stats.maxDepth <= 9
+    assert stats.totalDepth <= 200 * stats.maxDepth
+
+    # The callback is given a snapshot after each iteration
+    assert [snapshot['iterations'] for snapshot in snapshots] == \
+        range(1, 201)
+    assert snapshots[-1]['meanRolloutLength'] == \
+        float(stats.rolloutMoves) / 200
+
+    # The counters carry on over further searches
+    mcts.search(root, 50, stats=stats)
+    assert stats.iterations == stats.rollouts == 250
+    assert len(snapshots) == 250
+
+    stats = mcts.SearchStats(timeMoveSelection=False)
+    mcts.search(mcts.MCTSNode(tictactoe.TicTacToeGameState()), 20,
+                stats=stats)
+    assert stats.rollouts == 20 and stats.rolloutMoves > 0
+    assert stats.moveSelectionCalls == {}
+
+
+def testRolloutPolicies():
+    print "TEST: testRolloutPolicies()"
+
+    def position(moves):
+        cf = connectfour.BitboardConnectFourGameState()
+        for move in moves:
+            cf.executeMove(move)
+        return cf
+
+    random.seed(22)
+    policy = policies.ConnectFourTacticalPolicy()
+
+    # Player 1 completes the bottom row rather than block column 6
+    win = position([0, 6, 1, 6, 2, 6])
+    assert all(policy.selectMove(win) == 3 for _ in xrange(20))
+
+    # Without a win of its own, player 1 blocks column 6
+    threat = position([0, 6, 1, 6, 5, 6])
+    assert all(policy.selectMove(threat) == 6 for _ in xrange(20))
+
+    # A cut off rollout is scored for the player who moved last before it
+    calls = []
+    def evaluate(gamestate, player):
+        calls.append((gamestate.numMoves, player))
+        return 0.25 if player == 1 else -0.25
+    cutoff = mcts.RolloutPolicy(maxMoves=3, evaluate=evaluate)
+    cf = position([3])
+    assert mcts.rollout(cf, policy=cutoff) == 0.25
+    assert calls == [(4, 1)]
+    cf = position([3, 3])
+    assert mcts.rollout(cf, policy=cutoff) == -0.25
+    assert calls[-1] == (5, 2)
+
+
+def testArrayTree():
+    print "TEST: testArrayTree()"
+
+    random.seed(5)
+    tree = arraytree.ArrayTree(tictactoe.TicTacToeGameState())
+    assert tree.search(300) == 300
+    assert tree.visits[0] == 300
+
+    # The root's children hold every visit, and its value is theirs from
+    # the other side
+    statistics = tree.rootStatistics()
+    assert sum(visits for visits, _ in statistics.itervalues()) == 300
+    assert tree.value[0] == -sum(value for _, value in
+                                 statistics.itervalues())
+
+    # Any other node was visited once as a leaf, then through its children
+    for node in xrange(1, len(tree)):
+        first = tree.firstChild[node]
+        if first != -1:
+            assert tree.visits[node] == 1 + sum(
+                tree.visits[first:first + tree.numExpanded[node]])
+
+    # The NumPy and the plain loop UCT pick the same child
+    fullyExpanded = [node for node in xrange(len(tree))
+                     if tree.visits[node] and tree.numChildren[node] and
+                     tree.numExpanded[node] == tree.numChildren[node]]
+    assert fullyExpanded
+    numpy = arraytree.numpy
+    try:
+        vectorized = [tree._selectBestChild(node) for node in fullyExpanded]
+        arraytree.numpy = None
+        assert [tree._selectBestChild(node)
+                for node in fullyExpanded] == vectorized
+    finally:
+        arraytree.numpy = numpy
+
+
+def testExactSolver():
+    print "TEST: testExactSolver()"
+
+    def snapshot(ttt):
+        return (list(ttt.board), ttt.currentPlayer, ttt.winner, ttt.hash,
+                list(ttt.moveStack))
+
+    # Tic-tac-toe is a draw. After a corner and an adjacent edge, X wins by
+    # force, so the value is a loss for O, who just moved.
+    ticTacToe = solver.ticTacToeSolver()
+    ttt = tictactoe.TicTacToeGameState()
+    assert ticTacToe.solve(ttt) == 0
+    for move in [0, 1]:
+        ttt.executeMove(move)
+    assert ticTacToe.solve(ttt) == -1
+
+    # Solving from scratch plays every line out and takes it back
+    before = snapshot(ttt)
+    assert solver.ExactSolver().solve(ttt) == -1
+    assert snapshot(ttt) == before
+    assert solver.ExactSolver(maxEmptyCells=6).solve(ttt) is None
+
+    # Every root child is proven when it is expanded, each of its visits
+    # backs up its exact value, and the search picks a winning move
+    random.seed(16)
+    root = mcts.MCTSNode(ttt)
+    move = mcts.mcts(root, 300, solver=ticTacToe)
+    assert snapshot(ttt) == before
+    for child in root.children.itervalues():
+        assert child.provenValue == ticTacToe.solve(child.gamestate)
+        assert child.value == child.provenValue * child.visits
+    assert root.visits == 300
+    assert root.value == -sum(child.value
+                              for child in root.children.itervalues())
+    assert root.children[move].provenValue == 1
+
+
+def testBitboardConnectFour():
+    print "TEST: testBitboardConnectFour()"
+
+    def snapshot(cf):
+        return (cf.board, cf.currentPlayer, cf.winner, cf.getLegalMoves(),
+                cf.hash, cf.mirrorHash)
+
+    def winningMoves(cf, player):
+        # The columns where a stone of player wins, by trying each one
+        moves = []
+        for move in cf.getLegalMoves():
+            trial = cf.copy()
+            trial.currentPlayer = player
+            trial.executeMove(move)
+            if trial.winner == player:
+                moves.append(move)
+        return moves
+
+    def playAndCompare(moves):
+        # Plays the moves on both engines, and on both engines' mirror
+        # images, then takes them all back. Returns how many positions had
+        # a full column.
+        games = [connectfour.ConnectFourGameState(),
+                 connectfour.BitboardConnectFourGameState()]
+        mirrors = [connectfour.ConnectFourGameState(),
+                   connectfour.BitboardConnectFourGameState()]
+        for cf in games:
+            cf.trackUndo = True
+        history = []
+        fullColumns = 0
+        for move in moves:
+            reference, bitboard = games
+            for player in [1, 2]:
+                assert bitboard.getWinningMoves(player) == \
+                    winningMoves(reference, player)
+            fullColumns += len(reference.getLegalMoves()) < reference.width
+
+            history.append([snapshot(cf) for cf in games])
+            for cf, mirror in zip(games, mirrors):
+                cf.executeMove(move)
+                mirror.executeMove(cf.mirrorMove(move))
+                assert cf.mirrorHash == mirror.hash
+                assert cf.hash == mirror.mirrorHash
+
+            assert snapshot(reference)[:4] == snapshot(bitboard)[:4]
+
+        while history:
+            for cf in games:
+                cf.undoMove()
+            assert [snapshot(cf) for cf in games] == history.pop()
+
+        return fullColumns
+
+    # A game that fills the board without a four
+    draw = [0, 2, 4, 5, 3, 4, 3, 4, 1, 1, 6, 3, 2, 2, 2, 3, 1, 3, 2, 2, 3,
+            0, 6, 1, 5, 6, 1, 1, 5, 6, 5, 5, 0, 4, 4, 5, 4, 6, 6, 0, 0, 0]
+    cf = connectfour.BitboardConnectFourGameState()
+    for move in draw:
+        cf.executeMove(move)
+    assert cf.winner == 0
+    assert playAndCompare(draw) > 0
+
+    # The same position reached in another order hashes the same
+    first = connectfour.BitboardConnectFourGameState()
+    second = connectfour.BitboardConnectFourGameState()
+    for move in [0, 1, 2]:
+        first.executeMove(move)
+        second.executeMove(2 - move)
+    assert first.hash == second.hash
+
+    random.seed(7)
+    fullColumns = 0
+    for _ in xrange(100):
+        cf = connectfour.BitboardConnectFourGameState()
+        cf.trackUndo = True
+        while cf.winner is None:
+            cf.executeMove(random.choice(cf.getLegalMoves()))
+        fullColumns += playAndCompare(cf.moveStack)
+    assert fullColumns > 0
+
+
+def testConnectFourDiagonalWin():
+    print "TEST: testConnectFourDiagonalWin()"
+
+    # The last stone is the top end of a diagonal running down to the
+    # right. The clipped 7x7 box around it is not centred on it, so the
+    # diagonals through the corners of the box miss it.
+    cf = connectfour.ConnectFourGameState()
+    for move in [0, 2, 5, 1, 3, 0, 4, 5, 4, 6, 2, 4, 4, 4, 3, 5, 6, 3, 4,
+                 0, 5]:
+        cf.executeMove(move)
+        assert cf.winner is None
+    cf.executeMove(3)
+    print cf
+
+    assert cf.winner == 2
+
+
+def testSelectBestMove():
+    print "TEST: testSelectBestMove()"
+
+    # The most visited move wins over a better average from fewer visits,
+    # and breaks ties by average value
+    assert mcts.selectBestMoveFromStatistics(
+        {0: (40, 10), 1: (3, 3), 2: (0, 0)}) == 0
+    assert mcts.selectBestMoveFromStatistics(
+        {0: (40, 10), 1: (40, 20)}) == 1
+
+    # A search that ran out of time before its first iteration still
+    # returns a legal move; without a position there is none to return
+    root = mcts.StatelessMCTSNode(QuoridorGameState())
+    assert mcts.mcts(root, timeLimit=0) in root.gamestate.getLegalMoves()
+    try:
+        mcts.selectBestMoveFromStatistics({0: (0, 0)})
+        assert False
+    except ValueError:
+        pass
+
+    # A search stopped early returns the move it could no longer overtake
+    random.seed(2)
+    c = connectfour.BitboardConnectFourGameState()
+    for move in [3, 3, 2, 2]:
+        c.executeMove(move)
+    root = mcts.MCTSNode(c)
+    iterations = mcts.search(root, 5000, earlyStop=True)
+    assert iterations < 5000
+
+    visits = sorted((child.visits, move)
+                    for move, child in root.children.iteritems())
+    assert visits[-1][0] - visits[-2][0] > 5000 - iterations
+    assert root.selectBestMove() == visits[-1][1]
+
+
+def testMoveEncoding():
+    print "TEST: testMoveEncoding()"
+
+    for move in ['h23', 'v47', '13', '0']:
+        assert formatMove(parseMove(move)) == move
+
+    # Wall moves map onto their wall slots
+    q = QuoridorGameState()
+    assert q.wallSlotMoves[parseMove('v47') >> 1] == parseMove('v47')
+    assert q.wallSlotMoves[parseMove('h23') >> 1] == parseMove('h23')
+    assert parseMove('h23') >> 1 == 2 * 23 + 1
+
+    # The legal moves are all integers that format to the old strings
+    legalMoves = q.getLegalMoves()
+    assert all(isinstance(move, int) for move in legalMoves)
+    assert 'v11' in map(formatMove, legalMoves)
+    assert '67' in map(formatMove, legalMoves)
+
+
 def runAllTests():
     testVertexCellNeighbors()
     testWallBlockingOpponentVictory()
     testWallBlockingSelfVictory()
+    testWallBlockingThroughWallEnds()
     testHorizontalWallPlacement()
     testNeighborRemoval()
+    testMoveEncoding()
+    testFloodFillReachable()
+    testMoveCandidates()
+    testFrontier()
+    testSampleRandomLegalMove()
+    testShortestPathMove()
+    testDecidedWinner()
+    testZobristHash()
+    testPlaceableWallTracking()
+    testShortestPathCache()
+    testCopy()
+    testUndoMove()
+    testUnmakeSearch()
+    testTreeFile()
+    testTreeFileAfterReroot()
+    testOpeningBook()
+    testReroot()
+    testTranspositionReroot()
+    testTreeParallelMCTS()
+    testLeafParallelMCTS()
+    testRootParallelMCTS()
+    testBatchRollout()
+    testSearchStats()
+    testRolloutPolicies()
+    testArrayTree()
+    testExactSolver()
+    testBitboardConnectFour()
+    testConnectFourDiagonalWin()
+    testSelectBestMove()
     testBridgeAlgorithm()
     testValidPawnMovesTiming()
     testBridgeTiming()
+    testReachabilityTiming()
+    testCopyTiming()
     testGetLegalMovesTiming()
     testGamesPerSecond()
     # TODO: Test edgeWallGraph results for sanity
@@ -212,8 +1339,38 @@ def runPassFailTests():
     testVertexCellNeighbors()
     testWallBlockingOpponentVictory()
     testWallBlockingSelfVictory()
+    testWallBlockingThroughWallEnds()
     testHorizontalWallPlacement()
     testNeighborRemoval()
+    testMoveEncoding()
+    testFloodFillReachable()
+    testMoveCandidates()
+    testFrontier()
+    testSampleRandomLegalMove()
+    testShortestPathMove()
+    testDecidedWinner()
+    testZobristHash()
+    testPlaceableWallTracking()
+    testShortestPathCache()
+    testCopy()
+    testUndoMove()
+    testUnmakeSearch()
+    testTreeFile()
+    testTreeFileAfterReroot()
+    testOpeningBook()
+    testReroot()
+    testTranspositionReroot()
+    testTreeParallelMCTS()
+    testLeafParallelMCTS()
+    testRootParallelMCTS()
+    testBatchRollout()
+    testSearchStats()
+    testRolloutPolicies()
+    testArrayTree()
+    testExactSolver()
+    testBitboardConnectFour()
+    testConnectFourDiagonalWin()
+    testSelectBestMove()
 
 
 def main():
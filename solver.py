@@ -0,0 +1,182 @@
+"""
+Exact game values for positions small enough to solve outright. A search
+given an ExactSolver scores a solvable leaf with its proven value instead of
+a random rollout, and stops selecting below it (see mcts.search).
+"""
+
+import random
+import time
+
+import connectfour
+import mcts
+import tictactoe
+
+
+def _emptyCells(gamestate):
+    if isinstance(gamestate, tictactoe.TicTacToeGameState):
+        return gamestate.board.count(0)
+    if isinstance(gamestate, connectfour.BitboardConnectFourGameState):
+        return gamestate.width * gamestate.height - gamestate.numMoves
+    if isinstance(gamestate, connectfour.ConnectFourGameState):
+        return sum(row.count(0) for row in gamestate.board)
+    raise TypeError("No exact solver for " + type(gamestate).__name__)
+
+
+class ExactSolver(object):
+    """
+    Memoized negamax over positions keyed by their Zobrist hash. Only
+    positions with at most maxEmptyCells empty cells are solved; None
+    solves every position, which is only sensible for tic-tac-toe. Values
+    are kept for the lifetime of the solver, so one solver should only be
+    used for one game and board size.
+    """
+
+    def __init__(self, maxEmptyCells=None):
+        self.maxEmptyCells = maxEmptyCells
+
+        # Position hash to the value for the player to move: 1 for a win,
+        # 0 for a draw and -1 for a loss with best play
+        self.values = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def canSolve(self, gamestate):
+        return self.maxEmptyCells is None or \
+            _emptyCells(gamestate) <= self.maxEmptyCells
+
+    def solve(self, gamestate):
+        """
+        Returns the exact reward of the position for the player who just
+        moved, on the same scale as mcts.rollout, or None if the position
+        has too many empty cells. The gamestate is left unchanged.
+        """
+
+        if not self.canSolve(gamestate):
+            return None
+
+        return -self._search(gamestate, False)
+
+    def solveAll(self, gamestate):
+        """
+        Solves every position reachable from the gamestate, instead of
+        stopping at the first winning move of each position as solve does.
+        """
+
+        self._search(gamestate, True)
+
+    def _search(self, gamestate, exhaustive):
+        # Every move tried is taken back, so the game state records them
+        # while it is searched
+        tracked = mcts.enableUndo(gamestate)
+        try:
+            return self._negamax(gamestate, exhaustive)
+        finally:
+            if not tracked:
+                gamestate.trackUndo = False
+
+    def _negamax(self, gamestate, exhaustive):
+        value = self.values.get(gamestate.hash)
+        if value is not None:
+            return value
+
+        if gamestate.winner is not None:
+            # The player who just moved won, or the game is a draw
+            value = 0 if gamestate.winner == 0 else -1
+        else:
+            value = -1
+            for move in gamestate.getLegalMoves():
+                gamestate.executeMove(move)
+                value = max(value, -self._negamax(gamestate, exhaustive))
+                gamestate.undoMove()
+                if value == 1 and not exhaustive:
+                    break
+
+        self.values[gamestate.hash] = value
+
+        return value
+
+
+_ticTacToeSolver = None
+
+
+def ticTacToeSolver():
+    """
+    Returns a solver holding the values of every tic-tac-toe position. The
+    table is built on the first call and shared afterwards.
+    """
+
+    global _ticTacToeSolver
+    if _ticTacToeSolver is None:
+        _ticTacToeSolver = ExactSolver()
+        _ticTacToeSolver.solveAll(tictactoe.TicTacToeGameState())
+    return _ticTacToeSolver
+
+
+def _optimalMoves(gamestate):
+    solver = ExactSolver()
+    values = {}
+    for move in gamestate.getLegalMoves():
+        child = gamestate.copy()
+        child.executeMove(move)
+        values[move] = solver.solve(child)
+    best = max(values.itervalues())
+    return [move for move, value in values.iteritems() if value == best]
+
+
+def compareWithRollouts(gamestate, solver, iterations, trials):
+    """
+    Searches the position repeatedly with and without the solver and prints
+    how often the chosen move is optimal, the share of the root's visits
+    spent on optimal moves and how long a search takes.
+    """
+
+    optimal = _optimalMoves(gamestate)
+
+    print "%-10s %10s %10s %10s %10s" % ('search', 'iterations', 'optimal',
+                                          'visits', 'seconds')
+    for name, searchSolver in [('rollouts', None), ('solver', solver)]:
+        hits = 0
+        optimalVisits = 0
+        start = time.time()
+        for _ in xrange(trials):
+            root = mcts.MCTSNode(gamestate.copy())
+            mcts.search(root, iterations, solver=searchSolver)
+            hits += root.selectBestMove() in optimal
+            optimalVisits += sum(root.children[move].visits
+                                 for move in optimal if move in root.children)
+        elapsed = (time.time() - start) / trials
+        print "%-10s %10d %9d%% %9d%% %10.3f" % (
+            name, iterations, 100 * hits / trials,
+            100 * optimalVisits / (iterations * trials), elapsed)
+
+
+def main():
+    random.seed(0)
+
+    # O must answer on an edge; either free corner loses
+    ttt = tictactoe.TicTacToeGameState()
+    for move in [0, 4, 8]:
+        ttt.executeMove(move)
+
+    start = time.time()
+    solver = ticTacToeSolver()
+    print "Tic-tac-toe table: %d positions in %.2f seconds" % (
+        len(solver), time.time() - start)
+    for iterations in [50, 200]:
+        compareWithRollouts(ttt, solver, iterations, 20)
+    print
+
+    cf = connectfour.BitboardConnectFourGameState()
+    for move in [6, 0, 3, 3, 6, 2, 3, 4, 2, 6, 6, 5, 0, 6, 3, 4, 3, 3, 6, 1,
+                 0, 5, 1, 1, 2, 5, 1, 0]:
+        cf.executeMove(move)
+
+    # Only column 5 wins, though not at once
+    print "Connect Four, 14 empty cells"
+    for iterations in [100, 400]:
+        compareWithRollouts(cf, ExactSolver(maxEmptyCells=12), iterations,
+                            10)
+
+if __name__ == '__main__':
+    main()
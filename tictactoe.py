@@ -1,16 +1,33 @@
 
+import random
+
+# Zobrist keys, one per player and cell. The generator is seeded so that a
+# position hashes the same in every process.
+_zobristRandom = random.Random(3)
+ZOBRIST = [[_zobristRandom.getrandbits(64) for _ in xrange(9)]
+           for _ in xrange(2)]
+
+
 class TicTacToeGameState(object):
 
     def __init__(self):
         self.currentPlayer = 1
         self.board = [0] * 9
         self.winner = None
+        self.hash = 0
+
+        # Moves made on this state, most recent last, for undoMove. Only
+        # recorded while trackUndo is set, as rollouts never take moves
+        # back. A copy starts with an empty stack and without tracking.
+        self.trackUndo = False
+        self.moveStack = []
 
     def copy(self):
         gamestate = TicTacToeGameState()
         gamestate.board = list(self.board)
         gamestate.currentPlayer = self.currentPlayer
         gamestate.winner = self.winner
+        gamestate.hash = self.hash
 
         return gamestate
 
@@ -18,8 +35,19 @@ class TicTacToeGameState(object):
         assert self.winner is None
 
         self.board[move] = self.currentPlayer
+        self.hash ^= ZOBRIST[self.currentPlayer - 1][move]
         self.currentPlayer = 3 - self.currentPlayer
         self.checkForWin()
+        if self.trackUndo:
+            self.moveStack.append(move)
+
+    def undoMove(self):
+        move = self.moveStack.pop()
+
+        self.currentPlayer = 3 - self.currentPlayer
+        self.hash ^= ZOBRIST[self.currentPlayer - 1][move]
+        self.board[move] = 0
+        self.winner = None
 
     def getLegalMoves(self):
         return filter(lambda x: self.board[x] == 0, xrange(len(self.board)))
@@ -0,0 +1,273 @@
+"""
+Search trees saved to disk, so a later run can resume searching a position
+instead of starting over. A tree file holds every node's visits, value and
+position hash, and each node's children as (move, child) edges, in fixed
+size little-endian records:
+
+    header  magic, version, number of nodes, number of edges
+    nodes   visits, value, hash, first edge, number of edges  (36 bytes)
+    edges   move, child node index                             (8 bytes)
+
+Node 0 is the root. Moves must be integers, as for every game here.
+
+loadTree memory-maps the file and only reads the root and its children.
+Every other node reads its own children from the map the first time the
+search needs them (see MCTSNode._loadStoredChildren), so opening a tree
+takes the same time whatever its size and the operating system pages in
+only the parts of the file the search visits.
+"""
+
+import mmap
+import os
+import random
+import struct
+import tempfile
+import time
+
+import mcts
+
+MAGIC = 'MCTSTREE'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIQQ')
+_NODE = struct.Struct('<qdQqi')
+_EDGE = struct.Struct('<ii')
+
+
+class TreeFile(object):
+    """
+    Read access to a memory-mapped tree file. Nodes loaded from the file
+    keep a reference to it until their children have been read.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.numNodes, self.numEdges = \
+            _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d tree file" %
+                             (path, VERSION))
+
+        self.nodeOffset = _HEADER.size
+        self.edgeOffset = self.nodeOffset + self.numNodes * _NODE.size
+
+    def __len__(self):
+        return self.numNodes
+
+    def _node(self, index):
+        return _NODE.unpack_from(self.map,
+                                 self.nodeOffset + index * _NODE.size)
+
+    def hash(self, index):
+        return self._node(index)[2]
+
+    def edges(self, index):
+        """
+        Returns the (move, child index) pairs of the node's children.
+        """
+
+        firstEdge, numEdges = self._node(index)[3:]
+        offset = self.edgeOffset + firstEdge * _EDGE.size
+        return [_EDGE.unpack_from(self.map, offset + i * _EDGE.size)
+                for i in xrange(numEdges)]
+
+    def restore(self, node, index, mirrored=False):
+        """
+        Sets the node's statistics to those of stored node index and lets
+        the node read its stored children when it needs them. mirrored
+        means the node holds the mirror image of the stored position, see
+        TranspositionTable.
+        """
+
+        visits, value, _, _, numEdges = self._node(index)
+        node.visits = visits
+        node.value = int(value) if value.is_integer() else value
+        if numEdges:
+            node.stored = (self, index, mirrored)
+
+
+def saveTree(root, path):
+    """
+    Writes the tree under the root to path. Nodes shared in a DAG
+    (transposition) tree are written once. Any part of the tree that was
+    loaded from a file and not read yet is copied record by record from
+    that file, without building its nodes, so a tree can be saved over the
+    file it was loaded from. The file is replaced at once, after it has
+    been written completely.
+    """
+
+    # Stateless nodes do not know their position, so it is replayed along
+    # the way with the child nodes' moves; None entries undo a move
+    stateless = isinstance(root, mcts.StatelessMCTSNode)
+    gamestate = None
+    if stateless:
+        gamestate = root.gamestate.copy()
+        mcts.enableUndo(gamestate)
+
+    # The nodes to write are the tree's nodes, keyed by id, followed by
+    # the stored nodes not read yet as (tree file, index) pairs, keyed by
+    # file and index. Each tree node's edges are (move, child key) pairs.
+    nodes = []
+    hashes = []
+    nodeEdges = []
+    index = {}
+    stack = [(root, None)]
+    while stack:
+        node, move = stack.pop()
+        if node is None:
+            gamestate.undoMove()
+            continue
+        if stateless and move is not None:
+            gamestate.executeMove(move)
+            stack.append((None, None))
+        if id(node) in index:
+            continue
+
+        index[id(node)] = len(nodes)
+        nodes.append(node)
+        if not stateless:
+            gamestate = node.gamestate
+        hashes.append(gamestate.hash)
+        nodeEdges.append([(move, id(child))
+                          for move, child in node.children.iteritems()])
+        stack.extend((child, move)
+                     for move, child in node.children.iteritems())
+
+    # In a DAG a stored position may have been read into the tree through
+    # another parent since, and the tree's node is the one to keep
+    treeNodes = _nodesByHash(root, nodes)
+
+    stored = []
+    for node, edges in zip(nodes, nodeEdges):
+        if node.stored is None:
+            continue
+        storedTree, storedIndex, mirrored = node.stored
+        for move, child in storedTree.edges(storedIndex):
+            if mirrored:
+                move = node.gamestate.mirrorMove(move)
+            edges.append((move, (id(storedTree), child)))
+            stored.append((storedTree, child))
+
+    numTreeNodes = len(nodes)
+    while stored:
+        storedTree, storedIndex = stored.pop()
+        key = (id(storedTree), storedIndex)
+        if key in index:
+            continue
+
+        treeNode = treeNodes.get(storedTree.hash(storedIndex))
+        if treeNode is not None:
+            index[key] = index[id(treeNode)]
+            continue
+
+        index[key] = len(nodes)
+        nodes.append((storedTree, storedIndex))
+        stored.extend((storedTree, child)
+                      for _, child in storedTree.edges(storedIndex))
+
+    # Writing to a new file leaves a tree that is still mapped from the old
+    # one intact
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(nodes), 0))
+
+        firstEdge = 0
+        for i, node in enumerate(nodes):
+            if i < numTreeNodes:
+                visits, value, nodeHash = node.visits, node.value, hashes[i]
+                numEdges = len(nodeEdges[i])
+            else:
+                visits, value, nodeHash, _, numEdges = node[0]._node(node[1])
+            f.write(_NODE.pack(visits, value, nodeHash, firstEdge, numEdges))
+            firstEdge += numEdges
+
+        for i, node in enumerate(nodes):
+            if i < numTreeNodes:
+                for move, key in nodeEdges[i]:
+                    f.write(_EDGE.pack(move, index[key]))
+            else:
+                storedTree, storedIndex = node
+                for move, child in storedTree.edges(storedIndex):
+                    f.write(_EDGE.pack(move, index[(id(storedTree), child)]))
+
+        # The number of edges is only known now
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, len(nodes), firstEdge))
+
+    os.rename(temporaryPath, path)
+
+    return len(nodes)
+
+
+def _nodesByHash(root, nodes):
+    # The nodes of a transposition tree by the hash of their position and,
+    # for a symmetric table, of its mirror image, as a stored node may hold
+    # either. The edge to it keeps the move as stored, which loading
+    # mirrors along with the parent's other moves if need be.
+    table = getattr(root, 'table', None)
+    if table is None:
+        return {}
+
+    byHash = {}
+    for node in nodes:
+        byHash[node.gamestate.hash] = node
+        if table.symmetric:
+            byHash[node.gamestate.mirrorHash] = node
+
+    return byHash
+
+
+def loadTree(path, gamestate, nodeClass=mcts.MCTSNode, table=None):
+    """
+    Returns the root of the tree saved in path, as a nodeClass node for the
+    given position, which must be the one the tree was saved from. A
+    TranspositionMCTSNode tree uses the given table, or a new one.
+    """
+
+    storedTree = TreeFile(path)
+    if storedTree.hash(0) != gamestate.hash:
+        raise ValueError("%s holds the tree of another position" % path)
+
+    if table is None:
+        root = nodeClass(gamestate)
+    else:
+        root = nodeClass(gamestate, table=table)
+    storedTree.restore(root, 0)
+    root._loadStoredChildren(gamestate)
+
+    return root
+
+
+def main():
+    import connectfour
+
+    random.seed(0)
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+
+    print "Connect Four, 50000 iterations"
+    root = mcts.MCTSNode(connectfour.BitboardConnectFourGameState())
+    mcts.search(root, 50000)
+
+    start = time.time()
+    numNodes = saveTree(root, path)
+    print "Saved %d nodes, %.1f bytes per node, in %.2f seconds" % (
+        numNodes, float(os.path.getsize(path)) / numNodes,
+        time.time() - start)
+
+    start = time.time()
+    loaded = loadTree(path, connectfour.BitboardConnectFourGameState())
+    print "Loaded in %.4f seconds" % (time.time() - start)
+    assert loaded.rootStatistics() == root.rootStatistics()
+
+    start = time.time()
+    mcts.search(loaded, 10000)
+    print "Resumed for 10000 iterations in %.2f seconds, %d visits" % (
+        time.time() - start, loaded.visits)
+
+    os.remove(path)
+
+if __name__ == '__main__':
+    main()